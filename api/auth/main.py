@@ -1,3 +1,4 @@
+import math
 import sys
 import uuid
 
@@ -5,11 +6,13 @@ import aiohttp
 import loguru
 from fastapi import FastAPI, status
 from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import JSONResponse
 
 from api.auth.exceptions import UnauthorizedException
 from api.auth.utils import VerifyToken
 from config.auth_setting import auth_settings, auth_endpoints
+from resilience import CircuitOpenError
 
 token_verifier = VerifyToken()
 
@@ -26,6 +29,19 @@ logger.add(
 )
 
 
+@app.exception_handler(CircuitOpenError)
+async def jwks_unavailable(request, error: CircuitOpenError):
+    """
+    The JWKS endpoint is down and no stale keys are left to verify tokens with
+    """
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=jsonable_encoder({"message": str(error)}),
+        headers={"Retry-After": str(math.ceil(error.retry_after))},
+        media_type="application/json",
+    )
+
+
 @app.get(
     "/auth/echo",
     status_code=status.HTTP_200_OK
@@ -94,7 +110,8 @@ async def get_access_token():
 )
 async def authorize(access_token: str):
     try:
-        token_verifier.verify(access_token)
+        # Verification may fetch the JWKS, keep it off the event loop
+        await run_in_threadpool(token_verifier.verify, access_token)
         return JSONResponse(
             status_code=status.HTTP_200_OK,
             content=None,
@@ -1,7 +1,42 @@
+import time
+
 import jwt
 
 from api.auth.exceptions import ForbiddenException, BadRequestException, UnauthorizedException
 from config.auth_setting import auth_settings, auth_endpoints
+from config.resilience_setting import resilience_settings
+from resilience import budget, CircuitBreaker, CircuitOpenError
+
+
+class ResilientJWKClient(jwt.PyJWKClient):
+    """
+    PyJWKClient behind a circuit breaker. When the JWKS endpoint fails or
+    its circuit is open, the last JWK set fetched keeps being served for up
+    to `stale_ttl` seconds, so that tokens signed with known keys still verify.
+    """
+
+    def __init__(self, uri: str, stale_ttl: float = resilience_settings.JWKS_STALE_TTL, **kwargs):
+        kwargs.setdefault("timeout", resilience_settings.JWKS_TIMEOUT)
+        super().__init__(uri, **kwargs)
+        self.breaker = CircuitBreaker("jwks")
+        self.stale_ttl = stale_ttl
+        self._last_jwk_set = None
+        self._last_fetched_at = None
+
+    def fetch_data(self):
+        # Fail fast when the request has no time left for the round trip
+        budget(self.timeout)
+
+        try:
+            with self.breaker.guard():
+                jwk_set = super().fetch_data()
+        except (jwt.exceptions.PyJWKClientError, CircuitOpenError):
+            if self._last_jwk_set is None or time.monotonic() - self._last_fetched_at > self.stale_ttl:
+                raise
+            return self._last_jwk_set
+
+        self._last_jwk_set, self._last_fetched_at = jwk_set, time.monotonic()
+        return jwk_set
 
 
 class VerifyToken:
@@ -16,7 +51,7 @@ class VerifyToken:
         # This gets the JWKS from a given URL and does processing so you can
         # use any of the keys available
         jwks_url = self.endpoints.JWKS_ENDPOINT
-        self.jwks_client = jwt.PyJWKClient(jwks_url)
+        self.jwks_client = ResilientJWKClient(jwks_url)
 
     def verify(self, token: str):
 
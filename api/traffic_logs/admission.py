@@ -0,0 +1,237 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from enum import Enum
+from typing import Optional, Tuple
+
+import jwt
+from fastapi import Request
+
+from config.admission_setting import admission_settings
+from config.resilience_setting import resilience_settings
+from resilience import deadline
+from .exceptions import OverloadedException, RateLimitedException
+
+
+class RouteClass(str, Enum):
+    READ = "read"
+    WRITE = "write"
+    BULK = "bulk"
+
+
+BULK_PATH_SUFFIXES = ("/bulk", "/import")
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def classify(request: Request) -> RouteClass:
+    """Map an incoming request to the route class whose limits apply to it"""
+
+    if request.url.path.rstrip("/").endswith(BULK_PATH_SUFFIXES):
+        return RouteClass.BULK
+
+    if request.method in READ_METHODS:
+        return RouteClass.READ
+
+    return RouteClass.WRITE
+
+
+def client_keys(request: Request) -> Tuple[str, str]:
+    """
+    Rate limit keys of a request: its remote address, and its remote address
+    plus JWT subject.
+
+    The token is not verified here (that happens in the route, after
+    admission), so the subject is whatever the caller put in it. It only
+    splits the budget of an address between its clients: every request is
+    also charged to the address bucket, so minting fresh subjects does not
+    buy more requests, and a client's bucket can only be drained from its
+    own address. Behind a reverse proxy the address is the proxy's, unless
+    uvicorn runs with --proxy-headers.
+    """
+
+    address = f"addr:{request.client.host if request.client else 'unknown'}"
+
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+
+    if scheme.lower() == "bearer" and token:
+        try:
+            subject = jwt.decode(token, options={"verify_signature": False}).get("sub")
+            if subject:
+                return address, f"{address}|sub:{subject}"
+        except jwt.exceptions.PyJWTError:
+            pass
+
+    return address, address
+
+
+def request_timeout(request: Request, route_class: RouteClass) -> Optional[float]:
+    """
+    Time budget of a request: the one asked by the caller, capped to the
+    configured one. Bulk requests have none, each of their writes is bounded
+    by the per-dependency timeouts only.
+    """
+
+    if route_class == RouteClass.BULK:
+        return None
+
+    timeout = resilience_settings.REQUEST_TIMEOUT
+    try:
+        asked = float(request.headers.get(resilience_settings.DEADLINE_HEADER, timeout))
+    except ValueError:
+        asked = timeout
+
+    return min(timeout, asked) if asked > 0 else timeout
+
+
+class TokenBucket:
+    """Classic token bucket, refilled lazily on every take"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> float:
+        """Consume `cost` tokens, return 0 on success or the seconds to wait otherwise"""
+
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Per-client token buckets, bounded to the most recently seen clients"""
+
+    def __init__(self, rate: float, burst: int, max_clients: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+
+    def take(self, key: str) -> float:
+        bucket = self._buckets.pop(key, None) or TokenBucket(self.rate, self.burst)
+        self._buckets[key] = bucket
+
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+
+        return bucket.take()
+
+
+class ConcurrencyLimiter:
+    """
+    Bounded FIFO semaphore: at most `limit` requests run at once, at most
+    `max_queue` wait, and none waits longer than `latency_target` seconds.
+    """
+
+    def __init__(self, limit: int, max_queue: int, latency_target: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return True
+
+        if len(self._waiters) >= self.max_queue:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(waiter, self.latency_target)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            # The slot may have been handed over right before the client went away
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self):
+        # Hand the slot over to the oldest live waiter, if any
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.in_flight -= 1
+
+
+class AdmissionController:
+    """
+    Admission control for the traffic logs routes: per address and per client
+    rate limits first, then per route class concurrency limits. Bulk requests
+    are shed as soon as reads are queueing, so that bulk ingestion never
+    degrades interactive reads.
+    Admitted requests run under their deadline (time spent queueing included).
+    """
+
+    def __init__(self, settings=admission_settings):
+        self.rate_limiter = RateLimiter(
+            rate=settings.RATE_LIMIT_PER_SECOND,
+            burst=settings.RATE_LIMIT_BURST,
+            max_clients=settings.RATE_LIMIT_MAX_CLIENTS
+        )
+        self.address_rate_limiter = RateLimiter(
+            rate=settings.ADDRESS_RATE_LIMIT_PER_SECOND,
+            burst=settings.ADDRESS_RATE_LIMIT_BURST,
+            max_clients=settings.RATE_LIMIT_MAX_CLIENTS
+        )
+        self.limiters = {
+            RouteClass.READ: ConcurrencyLimiter(
+                settings.READ_CONCURRENCY, settings.READ_MAX_QUEUE, settings.READ_LATENCY_TARGET
+            ),
+            RouteClass.WRITE: ConcurrencyLimiter(
+                settings.WRITE_CONCURRENCY, settings.WRITE_MAX_QUEUE, settings.WRITE_LATENCY_TARGET
+            ),
+            RouteClass.BULK: ConcurrencyLimiter(
+                settings.BULK_CONCURRENCY, settings.BULK_MAX_QUEUE, settings.BULK_LATENCY_TARGET
+            ),
+        }
+
+    async def dispatch(self, request: Request, call_next):
+        address_key, client_key = client_keys(request)
+        wait = max(self.address_rate_limiter.take(address_key), self.rate_limiter.take(client_key))
+        if wait:
+            return RateLimitedException(retry_after=math.ceil(wait)).response()
+
+        route_class = classify(request)
+        limiter = self.limiters[route_class]
+
+        if route_class == RouteClass.BULK and self.limiters[RouteClass.READ].waiting:
+            return OverloadedException(retry_after=math.ceil(limiter.latency_target)).response()
+
+        with deadline(request_timeout(request, route_class)):
+            if not await limiter.acquire():
+                return OverloadedException(retry_after=math.ceil(limiter.latency_target)).response()
+
+            try:
+                return await call_next(request)
+            finally:
+                limiter.release()
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,241 @@
+import argparse
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from typing import List, Optional
+
+import loguru
+from bson import ObjectId
+from pymongo import ASCENDING
+
+from config.archive_setting import archive_settings
+from config.database_setting import database_settings
+from database import ReadProfile
+from .profiling import profiled
+from .sharding import default_shard_router
+
+logger = loguru.logger
+
+# Predicates pushed down to the archive scan, query parameter -> column
+FILTER_COLUMNS = {
+    "scheme": "scheme",
+    "method": "method",
+    "server_host": "server_host",
+    "client_host": "client_host",
+}
+
+
+class ArchiveColumnError(ValueError):
+    """Raised when a scan asks for columns the archive does not have"""
+
+
+def _pyarrow():
+    """pyarrow is only required by the archive, install the `archive` extra to use it"""
+
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as error:
+        raise RuntimeError("Traffic log archive requires pyarrow (poetry install -E archive)") from error
+
+    return pyarrow
+
+
+def _schema():
+    pa = _pyarrow()
+
+    return pa.schema([
+        ("id", pa.string()),
+        ("created_at", pa.timestamp("s", tz="UTC")),
+        ("scheme", pa.string()),
+        ("http_version", pa.string()),
+        ("method", pa.string()),
+        ("server_host", pa.string()),
+        ("server_port", pa.int32()),
+        ("client_host", pa.string()),
+        ("client_port", pa.int32()),
+        ("url", pa.string()),
+        ("headers", pa.list_(pa.struct([("key", pa.string()), ("value", pa.string())]))),
+        ("body", pa.string()),
+    ])
+
+
+def _partitioning():
+    pa = _pyarrow()
+    return pa.dataset.partitioning(pa.schema([("day", pa.string())]), flavor="hive")
+
+
+def _to_row(document: dict) -> dict:
+    """Flatten a stored traffic log into an archive row"""
+
+    server = document.get("server") or {}
+    client = document.get("client") or {}
+
+    return {
+        "id": str(document["_id"]),
+        "created_at": document["_id"].generation_time,
+        "scheme": document.get("scheme"),
+        "http_version": document.get("http_version"),
+        "method": document.get("method"),
+        "server_host": server.get("host"),
+        "server_port": server.get("port"),
+        "client_host": client.get("host"),
+        "client_port": client.get("port"),
+        "url": document.get("url"),
+        "headers": document.get("headers"),
+        "body": document.get("body"),
+    }
+
+
+def _day(document: dict) -> str:
+    return document["_id"].generation_time.date().isoformat()
+
+
+class ArchiveRepository:
+
+    @staticmethod
+    def _write_partition(day: str, documents: List[dict]):
+        pa = _pyarrow()
+
+        directory = os.path.join(archive_settings.ARCHIVE_DIRECTORY, f"day={day}")
+        os.makedirs(directory, exist_ok=True)
+
+        name = f"part-{documents[0]['_id']}-{documents[-1]['_id']}.parquet"
+        path = os.path.join(directory, name)
+        # Dot-prefixed, so a leftover from a crash is ignored by dataset discovery
+        tmp_path = os.path.join(directory, f".{name}.tmp")
+
+        table = pa.Table.from_pylist([_to_row(document) for document in documents], schema=_schema())
+
+        # The documents are deleted from Mongo right after, the file must be on disk first
+        with open(tmp_path, "wb") as file:
+            pa.parquet.write_table(table, file, compression=archive_settings.ARCHIVE_COMPRESSION)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def archive(older_than_days: int = archive_settings.ARCHIVE_AFTER_DAYS) -> int:
+        """
+        Move the traffic logs created more than `older_than_days` ago to Parquet
+        files partitioned by day, return the number of archived logs.
+
+        Documents are selected on their `_id` creation time, so the scan walks the
+        `_id` index, and are deleted from Mongo only once their file is written.
+        Rollup counters are left untouched: they keep counting archived requests.
+        Shards are archived one after the other, to bound memory usage.
+        """
+
+        cutoff = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(days=older_than_days))
+
+        archived = 0
+
+        shard_router = default_shard_router()
+
+        for shard in range(len(shard_router)):
+            collection = shard_router.collection(
+                shard,
+                read_profile=ReadProfile.PRIMARY,
+                write_profile=database_settings.DELETE_WRITE_PROFILE
+            )
+
+            while True:
+                documents = list(
+                    collection.find({"_id": {"$lt": cutoff}})
+                    .sort("_id", ASCENDING)
+                    .limit(archive_settings.ARCHIVE_BATCH_SIZE)
+                )
+                if not documents:
+                    break
+
+                for day, day_documents in groupby(documents, key=_day):
+                    day_documents = list(day_documents)
+
+                    ArchiveRepository._write_partition(day, day_documents)
+                    collection.delete_many({"_id": {"$in": [document["_id"] for document in day_documents]}})
+
+                    archived += len(day_documents)
+                    logger.info(f"Shard {shard}: archived {len(day_documents)} traffic logs of {day}")
+
+        return archived
+
+    @staticmethod
+    @profiled("repository")
+    def scan(
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            filters: Optional[dict] = None,
+            columns: Optional[List[str]] = None,
+            limit: int = 1000
+    ) -> List[dict]:
+        """
+        Scan archived traffic logs. Day partitions outside [start, end) are
+        pruned, equality `filters` (see FILTER_COLUMNS) are pushed down to the
+        Parquet row groups and only `columns` are read (default: all but the
+        day partition). Raises ArchiveColumnError for unknown columns.
+        """
+
+        pa = _pyarrow()
+        # Stored columns and the day partition
+        schema = _schema().append(pa.field("day", pa.string()))
+
+        unknown = [column for column in columns or [] if column not in schema.names]
+        if unknown:
+            raise ArchiveColumnError(
+                f"Unknown columns {', '.join(map(repr, unknown))}, expected some of {', '.join(schema.names)}"
+            )
+
+        if not os.path.isdir(archive_settings.ARCHIVE_DIRECTORY):
+            return []
+
+        dataset = pa.dataset.dataset(
+            archive_settings.ARCHIVE_DIRECTORY,
+            format="parquet",
+            partitioning=_partitioning(),
+            schema=schema
+        )
+
+        expression = None
+
+        def conjunction(left, right):
+            return right if left is None else left & right
+
+        if start:
+            # Day partitions are UTC days, naive datetimes are taken as UTC
+            start = start.astimezone(timezone.utc) if start.tzinfo else start.replace(tzinfo=timezone.utc)
+            expression = conjunction(expression, pa.dataset.field("day") >= start.date().isoformat())
+            expression = conjunction(expression, pa.dataset.field("created_at") >= pa.scalar(
+                start, type=pa.timestamp("s", tz="UTC")
+            ))
+        if end:
+            end = end.astimezone(timezone.utc) if end.tzinfo else end.replace(tzinfo=timezone.utc)
+            expression = conjunction(expression, pa.dataset.field("day") <= end.date().isoformat())
+            expression = conjunction(expression, pa.dataset.field("created_at") < pa.scalar(
+                end, type=pa.timestamp("s", tz="UTC")
+            ))
+
+        for name, value in (filters or {}).items():
+            if value is not None:
+                expression = conjunction(expression, pa.dataset.field(FILTER_COLUMNS[name]) == value)
+
+        table = dataset.head(limit, columns=columns or _schema().names, filter=expression)
+
+        return table.to_pylist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old traffic logs to Parquet files")
+    parser.add_argument("command", choices=["run"])
+    parser.add_argument("--days", type=int, default=archive_settings.ARCHIVE_AFTER_DAYS,
+                        help="Archive traffic logs older than this number of days")
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    archived = ArchiveRepository.archive(args.days)
+    print(f"{archived} traffic logs archived in {time.perf_counter() - started_at:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,693 @@
+import heapq
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from config.database_setting import database_settings
+from database import collection_for, guarded, traffic_log_rollup_collection, WriteProfile
+from .sharding import default_shard_router, ShardRouter
+
+# (server host, method, minute)
+RollupKey = Tuple[str, str, datetime]
+
+DUPLICATE_KEY = 11000
+
+# _id last: an exact header match is read in _id order, pages stop after `limit` index entries
+HEADERS_INDEX = [("headers.key", ASCENDING), ("headers.value", ASCENDING), ("_id", ASCENDING)]
+# Former headers index, a prefix of HEADERS_INDEX which still had to sort every match
+_LEGACY_HEADERS_INDEX = "headers.key_1_headers.value_1"
+CONTENT_HASH_INDEX = [("content_hash", ASCENDING)]
+
+
+def _rollup_id(host: str, method: str, minute: datetime) -> dict:
+    # Field order matters, Mongo compares embedded documents field by field
+    return {"host": host, "method": method, "minute": minute}
+
+
+class TrafficLogBackend(ABC):
+    """
+    Storage of the traffic logs and their rollup counters. Documents are the
+    encoded TrafficLogCreate bodies plus their `_id`, header keys already
+    normalized by the repository, and their `content_hash` when deduplication
+    is enabled. Profiles are ReadProfile and WriteProfile values (see
+    config.database_setting), backends honor them as far as they can.
+    """
+
+    @abstractmethod
+    def ensure_indexes(self):
+        pass
+
+    @abstractmethod
+    def get(self, traffic_log_id: ObjectId, read_profile: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def existing(self, traffic_log_ids: List[ObjectId], read_profile: str) -> Set[ObjectId]:
+        """The ids among `traffic_log_ids` which are still stored"""
+
+    def insert(self, traffic_log: dict, write_profile: str) -> ObjectId:
+        """Insert a single document, setting its `_id`"""
+
+        return self.insert_many([traffic_log], write_profile)[0]
+
+    @abstractmethod
+    def insert_many(self, traffic_logs: List[dict], write_profile: str) -> List[ObjectId]:
+        """Insert a batch of documents, setting their `_id`"""
+
+    def upsert(self, traffic_log: dict, write_profile: str) -> Tuple[ObjectId, bool]:
+        """Insert a single document unless its content hash is already stored"""
+
+        return self.upsert_many([traffic_log], write_profile)[0]
+
+    @abstractmethod
+    def upsert_many(self, traffic_logs: List[dict], write_profile: str) -> List[Tuple[ObjectId, bool]]:
+        """
+        Insert the documents whose `content_hash` is not stored yet, return for
+        each document its id (the existing one for duplicates) and whether it
+        was inserted. Duplicates within the batch resolve to the first one.
+        """
+
+    @abstractmethod
+    def find_by_header(self, header: dict, after: Optional[ObjectId], limit: int, read_profile: str) -> List[dict]:
+        """Documents with a header matching `header` ({key[, value]}), ordered by `_id`"""
+
+    @abstractmethod
+    def update(self, traffic_log_id: ObjectId, fields: dict, write_profile: str) -> Optional[dict]:
+        """
+        Set top-level `fields` and drop the content hash (the document no longer
+        matches what was ingested), return the document as it was before the update
+        """
+
+    @abstractmethod
+    def delete(self, traffic_log_id: ObjectId, write_profile: str) -> Optional[dict]:
+        """Delete a document, return it"""
+
+    @abstractmethod
+    def increment_rollups(
+            self,
+            counts: Dict[RollupKey, int],
+            flush_id: str,
+            write_profile: str
+    ) -> Dict[RollupKey, int]:
+        """
+        Add `counts` to the rollup buckets, return the counts which were
+        certainly not applied. Errors leave the flush partially applied or not:
+        it is then retried with the same `flush_id`, the buckets it already
+        reached must not count it twice.
+        """
+
+    @abstractmethod
+    def find_rollups(
+            self,
+            host: Optional[str],
+            method: Optional[str],
+            start: Optional[datetime],
+            end: Optional[datetime],
+            limit: int,
+            read_profile: str
+    ) -> List[dict]:
+        """Rollup buckets ({host, method, minute, count}) ordered by minute, `limit` 0 means no limit"""
+
+    @abstractmethod
+    def rebuild_rollups(self):
+        """Recompute every rollup bucket from the stored traffic logs"""
+
+
+class MongoBackend(TrafficLogBackend):
+    """
+    Traffic logs on MongoDB, spread over the shards of `router`. Request path
+    operations are `guarded`: bounded by the request deadline and failing
+    fast while the mongo circuit is open.
+    """
+
+    def __init__(self, router: ShardRouter, rollups: Collection):
+        self.router = router
+        self.rollups = rollups
+
+    @staticmethod
+    def _ensure_rollup_indexes(collection: Collection):
+        collection.create_index([("_id.minute", ASCENDING)])
+        collection.create_index(
+            [("_id.host", ASCENDING), ("_id.method", ASCENDING), ("_id.minute", ASCENDING)]
+        )
+
+    @staticmethod
+    def _ensure_headers_index(collection: Collection):
+        collection.create_index(HEADERS_INDEX)
+        if _LEGACY_HEADERS_INDEX in collection.index_information():
+            collection.drop_index(_LEGACY_HEADERS_INDEX)
+
+    def ensure_indexes(self):
+        # Multikey index, turns header lookups into index seeks
+        self.router.scatter(lambda shard, collection: self._ensure_headers_index(collection))
+        # Unique per shard: deduplicated writes are routed by content hash, identical logs share a shard
+        self.router.scatter(lambda shard, collection: collection.create_index(
+            CONTENT_HASH_INDEX, unique=True, partialFilterExpression={"content_hash": {"$exists": True}}
+        ))
+        self._ensure_rollup_indexes(self.rollups)
+
+    @guarded
+    def get(self, traffic_log_id, read_profile):
+        return self.router.route(
+            traffic_log_id,
+            lambda collection: collection.find_one({"_id": traffic_log_id}),
+            read_profile=read_profile
+        )
+
+    @guarded
+    def existing(self, traffic_log_ids, read_profile):
+        by_shard = defaultdict(list)
+        for traffic_log_id in traffic_log_ids:
+            by_shard[self.router.shard_of(traffic_log_id)].append(traffic_log_id)
+
+        def find(shard, collection):
+            shard_ids = by_shard.get(shard)
+            if not shard_ids:
+                return []
+            return [document["_id"] for document in collection.find({"_id": {"$in": shard_ids}}, {"_id": True})]
+
+        found = self.router.scatter(find, read_profile=read_profile)
+        return {traffic_log_id for shard_ids in found for traffic_log_id in shard_ids}
+
+    @guarded
+    def insert(self, traffic_log, write_profile):
+        shard = self.router.shard_for(traffic_log)
+        traffic_log["_id"] = self.router.new_id(shard)
+
+        result = self.router.collection(shard, write_profile=write_profile).insert_one(traffic_log)
+        assert result.acknowledged
+
+        return result.inserted_id
+
+    @guarded
+    def insert_many(self, traffic_logs, write_profile):
+        # One unordered insert per shard, run in parallel
+        by_shard = defaultdict(list)
+        for traffic_log in traffic_logs:
+            shard = self.router.shard_for(traffic_log)
+            traffic_log["_id"] = self.router.new_id(shard)
+            by_shard[shard].append(traffic_log)
+
+        def insert(shard, collection):
+            shard_traffic_logs = by_shard.get(shard)
+            if shard_traffic_logs:
+                assert collection.insert_many(shard_traffic_logs, ordered=False).acknowledged
+
+        self.router.scatter(insert, write_profile=write_profile)
+
+        return [traffic_log["_id"] for traffic_log in traffic_logs]
+
+    @guarded
+    def upsert_many(self, traffic_logs, write_profile):
+        by_shard = defaultdict(list)
+        for index, traffic_log in enumerate(traffic_logs):
+            shard = self.router.shard_for_hash(traffic_log["content_hash"])
+            traffic_log["_id"] = self.router.new_id(shard)
+            by_shard[shard].append(index)
+
+        results = [None] * len(traffic_logs)
+
+        def upsert(shard, collection):
+            indexes = by_shard.get(shard)
+            if not indexes:
+                return
+
+            # The hash is set by the equality filter: kept out of $setOnInsert, the server retries
+            # an upsert losing a race on the unique index (MongoDB 4.2+) instead of failing it
+            operations = [
+                UpdateOne(
+                    {"content_hash": traffic_logs[index]["content_hash"]},
+                    {"$setOnInsert": {k: v for k, v in traffic_logs[index].items() if k != "content_hash"}},
+                    upsert=True
+                )
+                for index in indexes
+            ]
+            # Ordered, so that a duplicate within the batch matches the document upserted before it
+            upserted_ids = {}
+            start = 0
+            while start < len(operations):
+                try:
+                    upserted = collection.bulk_write(operations[start:]).bulk_api_result["upserted"]
+                    failed_at = None
+                except BulkWriteError as error:
+                    # Lost a race with another ingest of the same log (server not retrying), the
+                    # operations after it did not run: resumed, the lost one resolves as a duplicate
+                    write_error = error.details["writeErrors"][0]
+                    if error.details.get("writeConcernErrors") or write_error["code"] != DUPLICATE_KEY:
+                        raise
+                    upserted = error.details["upserted"]
+                    failed_at = write_error["index"]
+
+                upserted_ids.update({start + upsert["index"]: upsert["_id"] for upsert in upserted})
+                if failed_at is None:
+                    break
+                start += failed_at + 1
+
+            duplicates = {traffic_logs[index]["content_hash"]
+                          for position, index in enumerate(indexes) if position not in upserted_ids}
+            existing_ids = {
+                document["content_hash"]: document["_id"]
+                for document in collection.find(
+                    {"content_hash": {"$in": list(duplicates)}}, {"content_hash": True}
+                )
+            } if duplicates else {}
+
+            for position, index in enumerate(indexes):
+                if position in upserted_ids:
+                    results[index] = (upserted_ids[position], True)
+                else:
+                    results[index] = (existing_ids[traffic_logs[index]["content_hash"]], False)
+
+        self.router.scatter(upsert, write_profile=write_profile)
+
+        return results
+
+    @guarded
+    def find_by_header(self, header, after, limit, read_profile):
+        # $elemMatch, so that key and value must match within the same header
+        query = {"headers": {"$elemMatch": header}}
+        if after:
+            query["_id"] = {"$gt": after}
+
+        def find(shard, collection):
+            # Without the hint the planner may prefer walking the _id index. With a key and a value,
+            # the index yields the matches in _id order; with a key only they are sorted.
+            return list(collection.find(query).hint(HEADERS_INDEX).sort("_id", ASCENDING).limit(limit))
+
+        results = self.router.scatter(find, read_profile=read_profile)
+        documents = heapq.merge(*results, key=lambda document: document["_id"])
+
+        return [document for document, _ in zip(documents, range(limit))]
+
+    @guarded
+    def update(self, traffic_log_id, fields, write_profile):
+        return self.router.route(
+            traffic_log_id,
+            lambda collection: collection.find_one_and_update(
+                {"_id": traffic_log_id},
+                {"$set": fields, "$unset": {"content_hash": ""}},
+                return_document=ReturnDocument.BEFORE
+            ),
+            write_profile=write_profile
+        )
+
+    @guarded
+    def delete(self, traffic_log_id, write_profile):
+        return self.router.route(
+            traffic_log_id,
+            lambda collection: collection.find_one_and_delete({"_id": traffic_log_id}),
+            write_profile=write_profile
+        )
+
+    @guarded
+    def increment_rollups(self, counts, flush_id, write_profile):
+        # Buckets keep the ids of their last flushes: once applied, a flush no longer matches, its
+        # upsert then fails on the duplicate _id and the bucket is left alone. The same error is
+        # raised when another process created the bucket concurrently, hence the marker check.
+        keys = list(counts)
+        operations = [
+            UpdateOne(
+                {"_id": _rollup_id(*key), "flushes": {"$ne": flush_id}},
+                {
+                    "$inc": {"count": counts[key]},
+                    "$push": {"flushes": {"$each": [flush_id], "$slice": -database_settings.ROLLUP_FLUSH_MARKERS}}
+                },
+                upsert=True
+            )
+            for key in keys
+        ]
+
+        collection = collection_for(write_profile=write_profile, collection=self.rollups)
+        try:
+            collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as error:
+            if error.details.get("writeConcernErrors"):
+                raise
+            failed = [keys[write_error["index"]] for write_error in error.details["writeErrors"]]
+            duplicates = {keys[write_error["index"]] for write_error in error.details["writeErrors"]
+                          if write_error["code"] == DUPLICATE_KEY}
+            applied = {
+                tuple(document["_id"].values())
+                for document in collection.find(
+                    {"_id": {"$in": [_rollup_id(*key) for key in duplicates]}, "flushes": flush_id},
+                    {"_id": True}
+                )
+            } if duplicates else set()
+
+            return {key: counts[key] for key in failed if key not in applied}
+
+        return {}
+
+    @guarded
+    def find_rollups(self, host, method, start, end, limit, read_profile):
+        query = {}
+        if host:
+            query["_id.host"] = host
+        if method:
+            query["_id.method"] = method
+        if start or end:
+            query["_id.minute"] = {}
+            if start:
+                query["_id.minute"]["$gte"] = start
+            if end:
+                query["_id.minute"]["$lt"] = end
+
+        collection = collection_for(read_profile=read_profile, collection=self.rollups)
+        # Without the flush markers, which outweigh the counts by far
+        documents = collection.find(query, {"count": True}).sort("_id.minute", ASCENDING).limit(limit)
+
+        return [{**document["_id"], "count": document["count"]} for document in documents]
+
+    def rebuild_rollups(self, batch_size: int = 10000):
+        """
+        Each shard is aggregated in parallel, the partial counts are summed here,
+        written to a scratch collection and renamed over the rollup collection.
+        """
+
+        created_at = {"$toDate": "$_id"}
+        minute = {"$subtract": [created_at, {"$mod": [{"$toLong": created_at}, 60 * 1000]}]}
+        pipeline = [
+            {"$group": {
+                "_id": {"host": "$server.host", "method": "$method", "minute": minute},
+                "count": {"$sum": 1}
+            }}
+        ]
+
+        counts = defaultdict(int)
+        for shard_buckets in self.router.scatter(
+                lambda shard, collection: list(collection.aggregate(pipeline, allowDiskUse=True))
+        ):
+            for bucket in shard_buckets:
+                counts[(bucket["_id"]["host"], bucket["_id"]["method"], bucket["_id"]["minute"])] += bucket["count"]
+
+        scratch = self.rollups.database[f"{self.rollups.name}_rebuild"]
+        scratch.drop()
+
+        buckets = [{"_id": _rollup_id(*key), "count": count} for key, count in counts.items()]
+        for index in range(0, len(buckets), batch_size):
+            scratch.insert_many(buckets[index:index + batch_size], ordered=False)
+
+        # Also creates the scratch collection when there is no bucket at all
+        self._ensure_rollup_indexes(scratch)
+        scratch.rename(self.rollups.name, dropTarget=True)
+
+
+class SqliteBackend(TrafficLogBackend):
+    """
+    Embedded traffic log store for edge deployments, on SQLite in WAL mode.
+
+    Documents are appended to a rowid table (ObjectIds grow with time, so the
+    `id` index is appended to as well) with the common query fields copied to
+    indexed columns; headers go to a side table indexed on (key, value).
+    Content hashes have a partial unique index, documents without one are not
+    deduplicated.
+    Batches are written in a single transaction. Read profiles are ignored,
+    the majority write profile maps to `synchronous=FULL`.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS traffic_logs (
+            rowid INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            created_at INTEGER NOT NULL,
+            scheme TEXT,
+            method TEXT,
+            server_host TEXT,
+            client_host TEXT,
+            content_hash TEXT,
+            document TEXT NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS traffic_logs_content_hash ON traffic_logs (content_hash)
+            WHERE content_hash IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS traffic_logs_server_host ON traffic_logs (server_host, created_at);
+        CREATE INDEX IF NOT EXISTS traffic_logs_method ON traffic_logs (method, created_at);
+        CREATE INDEX IF NOT EXISTS traffic_logs_client_host ON traffic_logs (client_host, created_at);
+
+        CREATE TABLE IF NOT EXISTS traffic_log_headers (
+            log_rowid INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS traffic_log_headers_key_value ON traffic_log_headers (key, value, log_rowid);
+        CREATE INDEX IF NOT EXISTS traffic_log_headers_log ON traffic_log_headers (log_rowid);
+
+        CREATE TABLE IF NOT EXISTS traffic_log_rollups (
+            host TEXT NOT NULL,
+            method TEXT NOT NULL,
+            minute INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (host, method, minute)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS traffic_log_rollups_minute ON traffic_log_rollups (minute);
+    """
+
+    def __init__(
+            self,
+            path: str = database_settings.SQLITE_PATH,
+            cache_size_kb: int = database_settings.SQLITE_CACHE_SIZE_KB,
+            mmap_size_mb: int = database_settings.SQLITE_MMAP_SIZE_MB,
+            busy_timeout: float = database_settings.SQLITE_BUSY_TIMEOUT
+    ):
+        self.path = path
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size_mb = mmap_size_mb
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            # Autocommit mode, transactions are explicit (see _transaction)
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(f"PRAGMA cache_size=-{self.cache_size_kb}")
+            connection.execute(f"PRAGMA mmap_size={self.mmap_size_mb * 1024 * 1024}")
+            connection.executescript(self.SCHEMA)
+            self._local.connection = connection
+
+        return connection
+
+    @contextmanager
+    def _transaction(self, write_profile: str):
+        connection = self._connection()
+        synchronous = "FULL" if write_profile == WriteProfile.MAJORITY else "NORMAL"
+        connection.execute(f"PRAGMA synchronous={synchronous}")
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    @staticmethod
+    def _document(traffic_log_id: str, document: str, content_hash: Optional[str] = None) -> dict:
+        document = {"_id": ObjectId(traffic_log_id), **json.loads(document)}
+        if content_hash:
+            document["content_hash"] = content_hash
+        return document
+
+    @staticmethod
+    def _write(connection: sqlite3.Connection, traffic_log: dict, rowid: Optional[int] = None):
+        """Insert (or replace, given its rowid) a document and its headers"""
+
+        document = {k: v for k, v in traffic_log.items() if k not in ("_id", "content_hash")}
+        server = document.get("server") or {}
+        client = document.get("client") or {}
+
+        cursor = connection.execute(
+            "INSERT OR REPLACE INTO traffic_logs "
+            "(rowid, id, created_at, scheme, method, server_host, client_host, content_hash, document) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                rowid,
+                str(traffic_log["_id"]),
+                int(traffic_log["_id"].generation_time.timestamp()),
+                document.get("scheme"),
+                document.get("method"),
+                server.get("host"),
+                client.get("host"),
+                traffic_log.get("content_hash"),
+                json.dumps(document, separators=(",", ":")),
+            )
+        )
+        rowid = cursor.lastrowid if rowid is None else rowid
+
+        connection.execute("DELETE FROM traffic_log_headers WHERE log_rowid = ?", (rowid,))
+        connection.executemany(
+            "INSERT INTO traffic_log_headers (log_rowid, key, value) VALUES (?, ?, ?)",
+            [(rowid, header["key"], header["value"]) for header in document.get("headers") or []]
+        )
+
+    def ensure_indexes(self):
+        # The schema is created along with each connection
+        self._connection()
+
+    def get(self, traffic_log_id, read_profile):
+        row = self._connection().execute(
+            "SELECT id, document FROM traffic_logs WHERE id = ?", (str(traffic_log_id),)
+        ).fetchone()
+
+        return self._document(*row) if row else None
+
+    def existing(self, traffic_log_ids, read_profile):
+        if not traffic_log_ids:
+            return set()
+
+        rows = self._connection().execute(
+            f"SELECT id FROM traffic_logs WHERE id IN ({', '.join('?' * len(traffic_log_ids))})",
+            [str(traffic_log_id) for traffic_log_id in traffic_log_ids]
+        )
+
+        return {ObjectId(traffic_log_id) for traffic_log_id, in rows}
+
+    def insert_many(self, traffic_logs, write_profile):
+        with self._transaction(write_profile) as connection:
+            for traffic_log in traffic_logs:
+                traffic_log["_id"] = ObjectId()
+                self._write(connection, traffic_log)
+
+        return [traffic_log["_id"] for traffic_log in traffic_logs]
+
+    def upsert_many(self, traffic_logs, write_profile):
+        results = []
+
+        # BEGIN IMMEDIATE holds the write lock, nobody can insert between the lookup and the insert
+        with self._transaction(write_profile) as connection:
+            for traffic_log in traffic_logs:
+                row = connection.execute(
+                    "SELECT id FROM traffic_logs WHERE content_hash = ?", (traffic_log["content_hash"],)
+                ).fetchone()
+                if row:
+                    results.append((ObjectId(row[0]), False))
+                    continue
+
+                traffic_log["_id"] = ObjectId()
+                self._write(connection, traffic_log)
+                results.append((traffic_log["_id"], True))
+
+        return results
+
+    def find_by_header(self, header, after, limit, read_profile):
+        conditions = ["key = ?"]
+        parameters = [header["key"]]
+        if "value" in header:
+            conditions.append("value = ?")
+            parameters.append(header["value"])
+
+        query = (
+            "SELECT id, document FROM traffic_logs WHERE rowid IN "
+            f"(SELECT log_rowid FROM traffic_log_headers WHERE {' AND '.join(conditions)})"
+        )
+        if after:
+            query += " AND id > ?"
+            parameters.append(str(after))
+        query += " ORDER BY id LIMIT ?"
+        parameters.append(limit)
+
+        return [self._document(*row) for row in self._connection().execute(query, parameters)]
+
+    def update(self, traffic_log_id, fields, write_profile):
+        with self._transaction(write_profile) as connection:
+            row = connection.execute(
+                "SELECT rowid, id, document, content_hash FROM traffic_logs WHERE id = ?", (str(traffic_log_id),)
+            ).fetchone()
+            if not row:
+                return None
+
+            before = self._document(*row[1:])
+            after = {k: v for k, v in before.items() if k != "content_hash"}
+            self._write(connection, {**after, **fields}, rowid=row[0])
+
+        return before
+
+    def delete(self, traffic_log_id, write_profile):
+        with self._transaction(write_profile) as connection:
+            row = connection.execute(
+                "SELECT rowid, id, document, content_hash FROM traffic_logs WHERE id = ?", (str(traffic_log_id),)
+            ).fetchone()
+            if not row:
+                return None
+
+            connection.execute("DELETE FROM traffic_log_headers WHERE log_rowid = ?", (row[0],))
+            connection.execute("DELETE FROM traffic_logs WHERE rowid = ?", (row[0],))
+
+        return self._document(*row[1:])
+
+    def increment_rollups(self, counts, flush_id, write_profile):
+        # A single transaction, a failed flush was not applied at all
+        with self._transaction(write_profile) as connection:
+            connection.executemany(
+                "INSERT INTO traffic_log_rollups (host, method, minute, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (host, method, minute) DO UPDATE SET count = count + excluded.count",
+                [
+                    (host, method, int(minute.replace(tzinfo=timezone.utc).timestamp()), count)
+                    for (host, method, minute), count in counts.items()
+                ]
+            )
+
+        return {}
+
+    def find_rollups(self, host, method, start, end, limit, read_profile):
+        conditions = []
+        parameters = []
+        for condition, value in (
+                ("host = ?", host),
+                ("method = ?", method),
+                ("minute >= ?", start),
+                ("minute < ?", end),
+        ):
+            if value:
+                conditions.append(condition)
+                if isinstance(value, datetime):
+                    value = int((value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp())
+                parameters.append(value)
+
+        query = "SELECT host, method, minute, count FROM traffic_log_rollups"
+        if conditions:
+            query += f" WHERE {' AND '.join(conditions)}"
+        query += " ORDER BY minute LIMIT ?"
+        parameters.append(limit or -1)
+
+        return [
+            {"host": host, "method": method, "minute": datetime.utcfromtimestamp(minute), "count": count}
+            for host, method, minute, count in self._connection().execute(query, parameters)
+        ]
+
+    def rebuild_rollups(self):
+        with self._transaction(WriteProfile.ACKNOWLEDGED) as connection:
+            connection.execute("DELETE FROM traffic_log_rollups")
+            connection.execute(
+                "INSERT INTO traffic_log_rollups (host, method, minute, count) "
+                "SELECT server_host, method, created_at - created_at % 60, COUNT(*) FROM traffic_logs "
+                "WHERE server_host IS NOT NULL AND method IS NOT NULL "
+                "GROUP BY server_host, method, created_at - created_at % 60"
+            )
+
+
+BACKENDS = {
+    "mongo": lambda: MongoBackend(default_shard_router(), traffic_log_rollup_collection()),
+    "sqlite": lambda: SqliteBackend(),
+}
+
+
+def create_backend(name: str) -> TrafficLogBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+storage_backend = create_backend(database_settings.STORAGE_BACKEND)
@@ -0,0 +1,110 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from database import ReadProfile, WriteProfile
+from .backends import BACKENDS, SqliteBackend, TrafficLogBackend
+
+METHODS = ["GET", "GET", "GET", "POST", "PUT", "DELETE"]
+HEADER_KEYS = ["user-agent", "accept", "content-type", "x-request-id", "authorization"]
+
+
+def _traffic_log(rng: random.Random) -> dict:
+    host = f"service-{rng.randrange(50)}.internal"
+
+    return {
+        "scheme": "https",
+        "http_version": "1.1",
+        "method": rng.choice(METHODS),
+        "server": {"host": host, "port": 443},
+        "client": {"host": f"10.0.{rng.randrange(256)}.{rng.randrange(256)}", "port": rng.randrange(1024, 65535)},
+        "url": f"https://{host}/api/v1/items/{rng.randrange(100000)}",
+        "headers": [{"key": key, "value": f"{key}-{rng.randrange(20)}"} for key in rng.sample(HEADER_KEYS, 3)],
+        "body": "x" * rng.randrange(0, 512),
+    }
+
+
+def _timed(operation: Callable[[], None], count: int) -> float:
+    started_at = time.perf_counter()
+    operation()
+    return count / (time.perf_counter() - started_at)
+
+
+def run(backend: TrafficLogBackend, logs: int, batch_size: int, reads: int, seed: int = 42) -> Dict[str, float]:
+    """Run the same workload on `backend`, return the throughput (operations/s) of each step"""
+
+    rng = random.Random(seed)
+    backend.ensure_indexes()
+
+    traffic_logs = [_traffic_log(rng) for _ in range(logs)]
+    singles = [_traffic_log(rng) for _ in range(max(1, logs // 10))]
+    ids: List = []
+
+    def insert_many():
+        for index in range(0, logs, batch_size):
+            ids.extend(backend.insert_many(traffic_logs[index:index + batch_size], WriteProfile.UNJOURNALED))
+
+    def insert():
+        for traffic_log in singles:
+            ids.append(backend.insert(traffic_log, WriteProfile.ACKNOWLEDGED))
+
+    def get():
+        for traffic_log_id in rng.choices(ids, k=reads):
+            backend.get(traffic_log_id, ReadProfile.PRIMARY)
+
+    def find_by_header():
+        for _ in range(reads // 10):
+            key = rng.choice(HEADER_KEYS)
+            backend.find_by_header({"key": key, "value": f"{key}-{rng.randrange(20)}"}, None, 100,
+                                   ReadProfile.PRIMARY)
+
+    def update():
+        for traffic_log_id in rng.sample(ids, min(reads, len(ids))):
+            backend.update(traffic_log_id, {"method": rng.choice(METHODS)}, WriteProfile.ACKNOWLEDGED)
+
+    def delete():
+        for traffic_log_id in rng.sample(ids, min(reads, len(ids))):
+            backend.delete(traffic_log_id, WriteProfile.ACKNOWLEDGED)
+
+    return {
+        "insert_many": _timed(insert_many, logs),
+        "insert": _timed(insert, len(singles)),
+        "get": _timed(get, reads),
+        "find_by_header": _timed(find_by_header, reads // 10),
+        "update": _timed(update, min(reads, len(ids))),
+        "delete": _timed(delete, min(reads, len(ids))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the traffic log storage backends on the same workload")
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), default=sorted(BACKENDS))
+    parser.add_argument("--logs", type=int, default=20000, help="Traffic logs inserted in batches")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--reads", type=int, default=2000, help="Gets, updates and deletes (searches are 1/10)")
+    parser.add_argument("--sqlite-path", default=None, help="SQLite file (default: a temporary file)")
+    args = parser.parse_args()
+
+    results = {}
+
+    for name in args.backends:
+        if name == "sqlite":
+            directory = tempfile.mkdtemp(prefix="traffic-logs-benchmark-")
+            backend = SqliteBackend(path=args.sqlite_path or os.path.join(directory, "traffic_logs.sqlite3"))
+        else:
+            # Runs against the configured database, use a dedicated one
+            backend = BACKENDS[name]()
+
+        results[name] = run(backend, args.logs, args.batch_size, args.reads)
+
+    steps = list(next(iter(results.values())))
+    print(f"{'ops/s':<16}" + "".join(f"{name:>14}" for name in results))
+    for step in steps:
+        print(f"{step:<16}" + "".join(f"{results[name][step]:>14,.0f}" for name in results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from bson import ObjectId
+
+from config.database_setting import database_settings
+
+# Fields which are not part of the logged request
+NON_CONTENT_FIELDS = ("_id", "content_hash")
+
+
+def content_hash(traffic_log: dict) -> str:
+    """
+    Canonical hash of an encoded traffic log: keys sorted, null fields dropped
+    (so bodies encoded with and without exclude_none hash the same), header
+    keys expected to be normalized already.
+    """
+
+    content = {k: v for k, v in traffic_log.items() if v is not None and k not in NON_CONTENT_FIELDS}
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class RecentHashes:
+    """Thread-safe LRU of content hash -> traffic log id"""
+
+    def __init__(self, capacity: int = database_settings.DEDUP_CACHE_SIZE):
+        self.capacity = capacity
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, hash_: str) -> Optional[ObjectId]:
+        with self._lock:
+            traffic_log_id = self._ids.get(hash_)
+            if traffic_log_id is not None:
+                self._ids.move_to_end(hash_)
+            return traffic_log_id
+
+    def put(self, hash_: str, traffic_log_id: ObjectId):
+        with self._lock:
+            self._ids[hash_] = traffic_log_id
+            self._ids.move_to_end(hash_)
+            if len(self._ids) > self.capacity:
+                self._ids.popitem(last=False)
+
+    def discard(self, hash_: Optional[str]):
+        with self._lock:
+            self._ids.pop(hash_, None)
+
+
+recent_hashes = RecentHashes()
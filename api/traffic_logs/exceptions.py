@@ -3,7 +3,7 @@ from typing import Type
 from fastapi import status as statuscode
 from fastapi.responses import JSONResponse
 
-from .models.errors import BaseError, NotFoundError, BaseIdentifiedError
+from .models.errors import BaseError, NotFoundError, BaseIdentifiedError, OverloadedError
 
 
 class BaseAPIException(Exception):
@@ -52,6 +52,39 @@ class TrafficLogNotFoundException(NotFoundException):
     """Error raised when a traffic log does not exist"""
 
 
+class OverloadedException(BaseAPIException):
+    """Base error for requests shed because the service is overloaded"""
+    message = "Service overloaded, retry later"
+    code = statuscode.HTTP_503_SERVICE_UNAVAILABLE
+    model = OverloadedError
+
+    def __init__(self, retry_after: int, **kwargs):
+        super().__init__(retry_after=retry_after, **kwargs)
+        self.retry_after = retry_after
+
+    def response(self):
+        response = super().response()
+        response.headers["Retry-After"] = str(self.retry_after)
+        return response
+
+
+class RateLimitedException(OverloadedException):
+    """Error raised when a client exceeds its request rate"""
+    message = "Rate limit exceeded, retry later"
+    code = statuscode.HTTP_429_TOO_MANY_REQUESTS
+
+
+class DependencyUnavailableException(OverloadedException):
+    """Error raised when a dependency fails and its circuit breaker is open"""
+    message = "A dependency is unavailable, retry later"
+
+
+class DeadlineExceededException(BaseAPIException):
+    """Error raised when a request runs out of its time budget"""
+    message = "The request did not complete within its deadline"
+    code = statuscode.HTTP_504_GATEWAY_TIMEOUT
+
+
 def get_exception_responses(
         *args: Type[BaseAPIException]
 ) -> dict:
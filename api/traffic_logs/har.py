@@ -0,0 +1,194 @@
+import json
+import time
+from typing import Iterator, List, Tuple
+from urllib.parse import urlsplit
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+
+from .models.traffic_log_create import TrafficLogCreate
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+WHITESPACE = " \t\n\r"
+# Longest token prefix a buffer may end with ("-Infinit", "\\uXXX"), errors in it may be truncation
+MAX_PARTIAL_TOKEN = 8
+
+
+class HarFormatError(ValueError):
+    """Raised when a file is not a well-formed HAR archive"""
+
+
+class _JsonStream:
+    """
+    Minimal pull parser over a text file: values are decoded one at a time
+    with `json.JSONDecoder.raw_decode`, so only the value being decoded has
+    to be held in memory.
+    """
+
+    def __init__(self, file, chunk_size: int = 1 << 20):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _truncated(self, error: json.JSONDecodeError) -> bool:
+        """Whether decoding failed because the value continues past the buffer, not on a syntax error"""
+
+        # Unterminated strings are reported at their opening quote, the other errors where decoding stopped
+        return error.msg.startswith("Unterminated string") or len(self.buffer) - error.pos <= MAX_PARTIAL_TOKEN
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise HarFormatError("Unexpected end of file")
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise HarFormatError(f"Expected '{char}' at offset {self.pos}, found '{self.buffer[self.pos]}'")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as error:
+                if self._truncated(error) and self._fill():
+                    continue
+                raise HarFormatError(str(error))
+
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof and self._fill():
+                continue
+
+            self.pos = end
+            return value
+
+    def members(self) -> Iterator[str]:
+        """Iterate over the keys of an object, the caller must consume each value"""
+
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def items(self) -> Iterator:
+        """Iterate over the items of an array, decoding them one at a time"""
+
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+
+        while True:
+            yield self.value()
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return
+
+
+def iter_har_entries(file) -> Iterator[dict]:
+    """Stream the `log.entries` of a HAR file opened in text mode"""
+
+    stream = _JsonStream(file)
+
+    for key in stream.members():
+        if key != "log":
+            stream.value()
+            continue
+
+        for log_key in stream.members():
+            if log_key == "entries":
+                yield from stream.items()
+            else:
+                stream.value()
+
+
+def har_entry_to_traffic_log(entry: dict) -> dict:
+    """Map a HAR entry to the encoded body of a TrafficLogCreate"""
+
+    request = entry["request"]
+    url = urlsplit(request["url"])
+    scheme = url.scheme.lower()
+
+    server_port = url.port or DEFAULT_PORTS.get(scheme, 0)
+    post_data = request.get("postData") or {}
+
+    traffic_log = TrafficLogCreate(
+        scheme=scheme,
+        http_version=request.get("httpVersion", "").upper().replace("HTTP/", "") or "1.1",
+        method=request["method"],
+        server={"host": url.hostname or entry.get("serverIPAddress", ""), "port": server_port},
+        client={"host": entry.get("_clientIPAddress", "0.0.0.0"), "port": entry.get("_clientPort", 0)},
+        url=request["url"],
+        headers=[{"key": h["name"], "value": h["value"]} for h in request.get("headers", [])],
+        body=post_data.get("text")
+    )
+
+    return jsonable_encoder(traffic_log, exclude_none=True)
+
+
+def map_har_entries(entries: List[dict]) -> Tuple[List[dict], int, float]:
+    """
+    Map a chunk of HAR entries, return the valid traffic logs, the number of
+    rejected entries and the seconds spent mapping
+    """
+
+    started_at = time.perf_counter()
+    traffic_logs = []
+    rejected = 0
+
+    for entry in entries:
+        try:
+            traffic_logs.append(har_entry_to_traffic_log(entry))
+        except (KeyError, TypeError, ValueError, ValidationError):
+            rejected += 1
+
+    return traffic_logs, rejected, time.perf_counter() - started_at
+
+
+def chunked(iterable: Iterator, size: int, skip: int = 0) -> Iterator[List]:
+    """Group `iterable` into lists of `size` items, dropping the first `skip` items"""
+
+    chunk = []
+    for index, item in enumerate(iterable):
+        if index < skip:
+            continue
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
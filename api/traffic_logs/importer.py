@@ -0,0 +1,190 @@
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, Optional
+
+import loguru
+
+from config.database_setting import WriteProfile
+from .har import chunked, iter_har_entries, map_har_entries
+from .repositories import TrafficLogRepository
+from .schemas import ImportSummary
+
+logger = loguru.logger
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# Mapping pools shared by all the imports of the process, by number of workers
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def _mapping_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool mapping HAR entries, created on first use. Workers are not
+    forked from the server, whose threads (threadpool, Mongo monitors) may
+    hold locks a forked child would never see released.
+    """
+
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            pool = _pools[workers] = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(method))
+        return pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Drop a broken pool (a worker died), the next import starts a new one"""
+
+    with _pools_lock:
+        for workers, shared_pool in list(_pools.items()):
+            if shared_pool is pool:
+                del _pools[workers]
+    pool.shutdown(wait=False)
+
+
+def _load_checkpoint(checkpoint_path: Optional[str]) -> dict:
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return {}
+
+    with open(checkpoint_path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _save_checkpoint(checkpoint_path: Optional[str], checkpoint: dict):
+    if not checkpoint_path:
+        return
+
+    # Write-then-rename, so a crash never leaves a truncated checkpoint behind
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(checkpoint, file)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def _timed(iterator: Iterator, summary: ImportSummary) -> Iterator:
+    """Accumulate the time spent producing items into `summary.parse_seconds`"""
+
+    while True:
+        started_at = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            summary.parse_seconds += time.perf_counter() - started_at
+        yield item
+
+
+def import_har_file(
+        path: str,
+        workers: Optional[int] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        checkpoint_path: Optional[str] = None,
+        write_profile: Optional[WriteProfile] = None
+) -> ImportSummary:
+    """
+    Import the entries of a HAR file into the traffic log store.
+
+    The file is stream-parsed in this process, chunks of entries are mapped to
+    TrafficLogCreate documents by a shared process pool and the results are written
+    with one `insert_many` per chunk, in order. After each chunk the number of
+    entries consumed is saved in the checkpoint file, so an interrupted import
+    resumes right after the last written chunk.
+    """
+
+    started_at = time.perf_counter()
+    checkpoint_key = os.path.abspath(path)
+    checkpoint = _load_checkpoint(checkpoint_path)
+
+    summary = ImportSummary(resumed_from=checkpoint.get(checkpoint_key, 0))
+    consumed = summary.resumed_from
+
+    workers = workers or os.cpu_count() or 1
+    pool = _mapping_pool(workers)
+
+    try:
+        with open(path, encoding="utf-8") as file:
+            # Bound the chunks in flight, so memory does not depend on the file size
+            max_pending = 2 * workers
+            pending = deque()
+
+            def drain():
+                nonlocal consumed
+
+                size, future = pending.popleft()
+                traffic_logs, rejected, map_seconds = future.result()
+
+                insert_started_at = time.perf_counter()
+                if traffic_logs:
+                    TrafficLogRepository.create_many(traffic_logs, write_profile=write_profile)
+                summary.insert_seconds += time.perf_counter() - insert_started_at
+
+                summary.entries += size
+                summary.imported += len(traffic_logs)
+                summary.rejected += rejected
+                summary.map_seconds += map_seconds
+
+                consumed += size
+                checkpoint[checkpoint_key] = consumed
+                _save_checkpoint(checkpoint_path, checkpoint)
+
+                logger.info(f"{path}: {consumed} entries processed, {summary.imported} imported, "
+                            f"{summary.rejected} rejected")
+
+            entries = _timed(iter_har_entries(file), summary)
+
+            for chunk in chunked(entries, chunk_size, skip=summary.resumed_from):
+                pending.append((len(chunk), pool.submit(map_har_entries, chunk)))
+                if len(pending) >= max_pending:
+                    drain()
+
+            while pending:
+                drain()
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+
+    summary.elapsed_seconds = time.perf_counter() - started_at
+
+    return summary
+
+
+def format_summary(summary: ImportSummary) -> str:
+    """Render the per-stage throughput of an import"""
+
+    def rate(count, seconds):
+        return f"{count / seconds:,.0f}/s" if seconds else "n/a"
+
+    return "\n".join([
+        f"entries:  {summary.entries} (resumed from {summary.resumed_from})",
+        f"parse:    {summary.parse_seconds:.2f}s, {rate(summary.entries, summary.parse_seconds)}",
+        f"map:      {summary.map_seconds:.2f}s worker time, {rate(summary.entries, summary.map_seconds)}",
+        f"insert:   {summary.insert_seconds:.2f}s, {rate(summary.imported, summary.insert_seconds)}",
+        f"total:    {summary.elapsed_seconds:.2f}s, {rate(summary.entries, summary.elapsed_seconds)}, "
+        f"{summary.imported} imported, {summary.rejected} rejected",
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import HAR files into the traffic log store")
+    parser.add_argument("paths", nargs="+", help="HAR files to import")
+    parser.add_argument("--workers", type=int, default=None, help="Mapping processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Entries per insert_many")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file used to resume interrupted imports")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        summary = import_har_file(path, args.workers, args.chunk_size, args.checkpoint)
+        print(f"== {path}\n{format_summary(summary)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,41 @@
+import math
+import os
 import sys
+import tempfile
 import uuid
+from datetime import datetime
+from typing import Optional
 
 import loguru
-from fastapi import FastAPI, status, Path, Depends
+from fastapi import FastAPI, status, Path, Depends, Request, Query
 from fastapi.encoders import jsonable_encoder
 from fastapi.security import HTTPBearer
+from starlette.concurrency import run_in_threadpool
 
-from api.traffic_logs.schemas import TrafficLogResponse
+from config.database_setting import ReadProfile, WriteProfile
+from resilience import DeadlineExceeded, DependencyUnavailable
+
+from api.traffic_logs.schemas import TrafficLogResponse, ImportResponse, RollupResponse, ArchiveResponse, \
+    TrafficLogSearchResponse, TrafficLogSearchResult
+from .archive import ArchiveColumnError, ArchiveRepository
+from .admission import admission_controller
 from .exceptions import *
+from .har import HarFormatError
+from .importer import import_har_file
+from .profiling import ProfilingMiddleware, profiled
 from .models.traffic_log_create import TrafficLogCreate
 from .models.traffic_log_update import TrafficLogUpdate
 from .repositories import TrafficLogRepository
+from .rollups import RollupRepository
 from ..auth import main as auth_app
 from ..auth.exceptions import UnauthorizedException, ForbiddenException
 
 # Scheme for the Authorization header
 token_auth_scheme = HTTPBearer()
 
+# Upload bytes gathered before each write of the spooled HAR file
+SPOOL_BUFFER_SIZE = 1024 * 1024
+
 app = FastAPI(
     title="Traffic Logs Controller"
 )
@@ -30,6 +49,53 @@ logger.add(
 )
 
 
+# Profile the request when asked by an authorized caller or sampled
+app.add_middleware(ProfilingMiddleware)
+
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """
+    Shed load with 429/503 before it reaches the Mongo pool and the threadpool
+    """
+    return await admission_controller.dispatch(request, call_next)
+
+
+@app.exception_handler(DependencyUnavailable)
+async def dependency_unavailable(request: Request, error: DependencyUnavailable):
+    """
+    503 when a dependency (Mongo, JWKS) cannot be reached or its circuit is open
+    """
+    return DependencyUnavailableException(retry_after=math.ceil(error.retry_after)).response()
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded(request: Request, error: DeadlineExceeded):
+    """
+    504 when the request ran out of its time budget waiting for a dependency
+    """
+    return DeadlineExceededException().response()
+
+
+@profiled("auth")
+def authorize(access_token: str):
+    """
+    Verify the bearer token, raising UnauthorizedException or ForbiddenException.
+    It may fetch the JWKS, so async routes must run it in the threadpool.
+    """
+    auth_app.token_verifier.verify(access_token)
+
+
+@profiled("serialization")
+def encode_response(response) -> dict:
+    return jsonable_encoder(response, exclude_none=True)
+
+
+@app.on_event("startup")
+def ensure_indexes():
+    TrafficLogRepository.ensure_indexes()
+
+
 @app.get(
     "/agent/traffic_logs/echo",
     status_code=status.HTTP_200_OK
@@ -41,6 +107,217 @@ def echo():
     return {"message": "Echo method"}
 
 
+@app.get(
+    "/agent/traffic_logs/rollups",
+    description="Fetch the request counts per host, method and minute",
+    response_model=RollupResponse
+)
+def fetch_rollups(
+        host: Optional[str] = Query(None, description="Only count requests to this server host"),
+        method: Optional[str] = Query(None, description="Only count requests with this HTTP method"),
+        start: Optional[datetime] = Query(None, description="First minute to include (UTC)"),
+        end: Optional[datetime] = Query(None, description="First minute to exclude (UTC)"),
+        limit: int = Query(10000, ge=1, description="Maximum number of buckets to return"),
+        read_profile: Optional[ReadProfile] = Query(None, description="Read routing override for this request"),
+        access_token: str = Depends(token_auth_scheme)
+):
+    request_id = str(uuid.uuid4())
+
+    with logger.contextualize(request_id=request_id):
+
+        try:
+
+            authorize(access_token.credentials)
+
+            buckets = RollupRepository.list(host, method, start, end, limit, read_profile=read_profile)
+
+            response = RollupResponse(
+                status=status.HTTP_200_OK,
+                message=f"{len(buckets)} rollup buckets found",
+                buckets=buckets
+            )
+
+            return JSONResponse(
+                content=encode_response(response),
+                media_type="application/json",
+            )
+
+        except UnauthorizedException:
+
+            response = RollupResponse(
+                status=status.HTTP_401_UNAUTHORIZED,
+                message="Unauthorized to retrieve rollups"
+            )
+
+            return JSONResponse(
+                status_code=response.status,
+                content=encode_response(response),
+                media_type="application/json",
+            )
+
+        except ForbiddenException:
+
+            response = RollupResponse(
+                status=status.HTTP_403_FORBIDDEN,
+                message="Rollups cannot be accessed"
+            )
+
+            return JSONResponse(
+                status_code=response.status,
+                content=encode_response(response),
+                media_type="application/json",
+            )
+
+
+@app.get(
+    "/agent/traffic_logs/archive",
+    description="Scan the archived (cold tier) traffic logs",
+    response_model=ArchiveResponse
+)
+def fetch_archived_traffic_logs(
+        start: Optional[datetime] = Query(None, description="Only logs created from this time (UTC)"),
+        end: Optional[datetime] = Query(None, description="Only logs created before this time (UTC)"),
+        scheme: Optional[str] = Query(None),
+        method: Optional[str] = Query(None),
+        server_host: Optional[str] = Query(None),
+        client_host: Optional[str] = Query(None),
+        columns: Optional[str] = Query(None, description="Comma separated list of columns to return"),
+        limit: int = Query(1000, ge=1, le=100000, description="Maximum number of logs to return"),
+        access_token: str = Depends(token_auth_scheme)
+):
+    request_id = str(uuid.uuid4())
+
+    with logger.contextualize(request_id=request_id):
+
+        try:
+
+            authorize(access_token.credentials)
+
+            traffic_logs = ArchiveRepository.scan(
+                start=start,
+                end=end,
+                filters={"scheme": scheme, "method": method, "server_host": server_host, "client_host": client_host},
+                columns=columns.split(",") if columns else None,
+                limit=limit
+            )
+
+            response = ArchiveResponse(
+                status=status.HTTP_200_OK,
+                message=f"{len(traffic_logs)} archived traffic logs found",
+                traffic_logs=traffic_logs
+            )
+
+            return JSONResponse(
+                content=encode_response(response),
+                media_type="application/json",
+            )
+
+        except UnauthorizedException:
+
+            response = ArchiveResponse(
+                status=status.HTTP_401_UNAUTHORIZED,
+                message="Unauthorized to retrieve archived Traffic logs"
+            )
+
+            return JSONResponse(
+                status_code=response.status,
+                content=encode_response(response),
+                media_type="application/json",
+            )
+
+        except ForbiddenException:
+
+            response = ArchiveResponse(
+                status=status.HTTP_403_FORBIDDEN,
+                message="Archived Traffic logs cannot be accessed"
+            )
+
+            return JSONResponse(
+                status_code=response.status,
+                content=encode_response(response),
+                media_type="application/json",
+            )
+
+        except ArchiveColumnError as error:
+
+            response = ArchiveResponse(
+                status=status.HTTP_400_BAD_REQUEST,
+                message=str(error)
+            )
+
+            return JSONResponse(
+                status_code=response.status,
+                content=encode_response(response),
+                media_type="application/json",
+            )
+
+
+@app.get(
+    "/agent/traffic_logs/headers",
+    description="Search TrafficLogs by header key and, optionally, value",
+    response_model=TrafficLogSearchResponse
+)
+def search_traffic_logs_by_header(
+        key: str = Query(..., description="Header key, case-insensitive"),
+        value: Optional[str] = Query(None, description="Header value, exact match"),
+        after: Optional[str] = Query(None, description="Only return TrafficLogs with a greater ID, for pagination"),
+        limit: int = Query(100, ge=1, le=1000, description="Maximum number of TrafficLogs to return"),
+        read_profile: Optional[ReadProfile] = Query(None, description="Read routing override for this request"),
+        access_token: str = Depends(token_auth_scheme)
+):
+    request_id = str(uuid.uuid4())
+
+    with logger.contextualize(request_id=request_id):
+
+        try:
+
+            authorize(access_token.credentials)
+
+            logger.info(f"Searching traffic logs by header {key}={value}")
+
+            results = TrafficLogRepository.search_by_header(key, value, after, limit, read_profile=read_profile)
+
+            response = TrafficLogSearchResponse(
+                status=status.HTTP_200_OK,
+                message=f"{len(results)} traffic logs found",
+                results=[
+                    TrafficLogSearchResult(id=str(traffic_log_id), traffic_log=traffic_log)
+                    for traffic_log_id, traffic_log in results
+                ]
+            )
+
+            return JSONResponse(
+                content=encode_response(response),
+                media_type="application/json",
+            )
+
+        except UnauthorizedException:
+
+            response = TrafficLogSearchResponse(
+                status=status.HTTP_401_UNAUTHORIZED,
+                message="Unauthorized to search Traffic logs"
+            )
+
+            return JSONResponse(
+                status_code=response.status,
+                content=encode_response(response),
+                media_type="application/json",
+            )
+
+        except ForbiddenException:
+
+            response = TrafficLogSearchResponse(
+                status=status.HTTP_403_FORBIDDEN,
+                message="Traffic logs cannot be searched"
+            )
+
+            return JSONResponse(
+                status_code=response.status,
+                content=encode_response(response),
+                media_type="application/json",
+            )
+
+
 @app.get(
     "/agent/traffic_logs/{traffic_log_id}",
     description="Fetch a single TrafficLog by its ID",
@@ -48,6 +325,7 @@ def echo():
 )
 def fetch_traffic_log(
         traffic_log_id: str = Path(title="The ID of the traffic log to retrieve"),
+        read_profile: Optional[ReadProfile] = Query(None, description="Read routing override for this request"),
         access_token: str = Depends(token_auth_scheme)
 ):
     request_id = str(uuid.uuid4())
@@ -56,11 +334,11 @@ def fetch_traffic_log(
 
         try:
 
-            auth_app.authorize(access_token.credentials)
+            authorize(access_token.credentials)
 
             logger.info(f"Fetching traffic log ID {traffic_log_id}")
 
-            result = TrafficLogRepository.get(traffic_log_id)
+            result = TrafficLogRepository.get(traffic_log_id, read_profile=read_profile)
 
             logger.info(f"Successfully retrieved traffic log {result}")
 
@@ -71,7 +349,7 @@ def fetch_traffic_log(
             )
 
             return JSONResponse(
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json",
             )
 
@@ -84,7 +362,7 @@ def fetch_traffic_log(
 
             return JSONResponse(
                 status_code=response.status,
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json",
             )
 
@@ -97,7 +375,7 @@ def fetch_traffic_log(
 
             return JSONResponse(
                 status_code=response.status,
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json",
             )
 
@@ -110,7 +388,7 @@ def fetch_traffic_log(
 
             return JSONResponse(
                 status_code=response.status,
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json",
             )
 
@@ -123,6 +401,7 @@ def fetch_traffic_log(
 def patch_traffic_log(
         traffic_log_update: TrafficLogUpdate,
         traffic_log_id: str = Path(title="The ID of the traffic log to retrieve"),
+        write_profile: Optional[WriteProfile] = Query(None, description="Durability override for this request"),
         access_token: str = Depends(token_auth_scheme)
 
 ):
@@ -134,9 +413,9 @@ def patch_traffic_log(
 
         try:
 
-            auth_app.authorize(access_token.credentials)
+            authorize(access_token.credentials)
 
-            result = TrafficLogRepository.update(traffic_log_id, traffic_log_update)
+            result = TrafficLogRepository.update(traffic_log_id, traffic_log_update, write_profile=write_profile)
 
             response = TrafficLogResponse(
                 status=status.HTTP_200_OK,
@@ -145,7 +424,7 @@ def patch_traffic_log(
             )
 
             return JSONResponse(
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json"
             )
 
@@ -158,7 +437,7 @@ def patch_traffic_log(
 
             return JSONResponse(
                 status_code=response.status,
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json",
             )
 
@@ -171,7 +450,7 @@ def patch_traffic_log(
 
             return JSONResponse(
                 status_code=response.status,
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json",
             )
 
@@ -184,7 +463,7 @@ def patch_traffic_log(
 
             return JSONResponse(
                 status_code=response.status,
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json",
             )
 
@@ -197,6 +476,7 @@ def patch_traffic_log(
 )
 def delete_traffic_log(
         traffic_log_id: str = Path(title="The ID of the traffic log to delete"),
+        write_profile: Optional[WriteProfile] = Query(None, description="Durability override for this request"),
         access_token: str = Depends(token_auth_scheme)
 ):
     request_id = str(uuid.uuid4())
@@ -207,9 +487,9 @@ def delete_traffic_log(
 
         try:
 
-            auth_app.authorize(access_token.credentials)
+            authorize(access_token.credentials)
 
-            TrafficLogRepository.delete(traffic_log_id)
+            TrafficLogRepository.delete(traffic_log_id, write_profile=write_profile)
 
             logger.info(f"Successfully deleted traffic log ID {traffic_log_id}")
 
@@ -220,7 +500,7 @@ def delete_traffic_log(
             )
 
             return JSONResponse(
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json"
             )
 
@@ -233,7 +513,7 @@ def delete_traffic_log(
 
             return JSONResponse(
                 status_code=response.status,
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json",
             )
 
@@ -246,7 +526,7 @@ def delete_traffic_log(
 
             return JSONResponse(
                 status_code=response.status,
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json",
             )
 
@@ -258,7 +538,7 @@ def delete_traffic_log(
 
             return JSONResponse(
                 status_code=response.status,
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json",
             )
 
@@ -270,6 +550,7 @@ def delete_traffic_log(
 )
 async def create_traffic_log(
         request: TrafficLogCreate,
+        write_profile: Optional[WriteProfile] = Query(None, description="Durability override for this request"),
         access_token: str = Depends(token_auth_scheme)
 ):
     request_id = str(uuid.uuid4())
@@ -278,25 +559,37 @@ async def create_traffic_log(
 
         try:
 
-            await auth_app.authorize(access_token.credentials)
+            await run_in_threadpool(authorize, access_token.credentials)
 
             traffic_log_request = jsonable_encoder(request)
 
             logger.info(f"Received request {request}")
 
-            resultId, result = TrafficLogRepository.create(traffic_log_request)
+            # Blocking driver call, the event loop must stay free for admission control
+            resultId, result, created = await run_in_threadpool(
+                TrafficLogRepository.create, traffic_log_request, write_profile=write_profile
+            )
 
-            logger.info(f"Successfully created TrafficLog {result}")
+            if created:
+                logger.info(f"Successfully created TrafficLog {result}")
 
-            response = TrafficLogResponse(
-                status=status.HTTP_201_CREATED,
-                message=f"Traffic log ID {resultId} created",
-                traffic_log=result
-            )
+                response = TrafficLogResponse(
+                    status=status.HTTP_201_CREATED,
+                    message=f"Traffic log ID {resultId} created",
+                    traffic_log=result
+                )
+            else:
+                logger.info(f"TrafficLog {resultId} already exists")
+
+                response = TrafficLogResponse(
+                    status=status.HTTP_200_OK,
+                    message=f"Traffic log ID {resultId} already exists",
+                    traffic_log=result
+                )
 
             return JSONResponse(
                 status_code=response.status,
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json"
             )
 
@@ -309,7 +602,7 @@ async def create_traffic_log(
 
             return JSONResponse(
                 status_code=response.status,
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
                 media_type="application/json",
             )
 
@@ -322,6 +615,103 @@ async def create_traffic_log(
 
             return JSONResponse(
                 status_code=response.status,
-                content=jsonable_encoder(response, exclude_none=True),
+                content=encode_response(response),
+                media_type="application/json",
+            )
+
+
+async def _spool(request: Request, har_file):
+    """Write the request body to `har_file` and close it, the file I/O runs off the event loop"""
+
+    try:
+        buffer = bytearray()
+        async for chunk in request.stream():
+            buffer += chunk
+            # Batched, not to hop to the threadpool for every small chunk of the body
+            if len(buffer) >= SPOOL_BUFFER_SIZE:
+                await run_in_threadpool(har_file.write, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(har_file.write, bytes(buffer))
+    finally:
+        await run_in_threadpool(har_file.close)
+
+
+@app.post(
+    "/agent/traffic_logs/import",
+    description="Import the entries of a HAR file, sent as the raw request body",
+    response_model=ImportResponse
+)
+async def import_traffic_logs(
+        request: Request,
+        write_profile: Optional[WriteProfile] = Query(None, description="Durability override for this request"),
+        access_token: str = Depends(token_auth_scheme)
+):
+    request_id = str(uuid.uuid4())
+
+    with logger.contextualize(request_id=request_id):
+
+        try:
+
+            await run_in_threadpool(authorize, access_token.credentials)
+
+            # Spool the upload to disk, the importer stream-parses it from there
+            har_file = await run_in_threadpool(tempfile.NamedTemporaryFile, suffix=".har", delete=False)
+            try:
+                await _spool(request, har_file)
+                summary = await run_in_threadpool(import_har_file, har_file.name, write_profile=write_profile)
+            finally:
+                await run_in_threadpool(os.remove, har_file.name)
+
+            logger.info(f"Successfully imported HAR file {summary}")
+
+            response = ImportResponse(
+                status=status.HTTP_201_CREATED,
+                message=f"{summary.imported} traffic logs imported, {summary.rejected} rejected",
+                summary=summary
+            )
+
+            return JSONResponse(
+                status_code=response.status,
+                content=encode_response(response),
+                media_type="application/json"
+            )
+
+        except UnauthorizedException:
+
+            response = ImportResponse(
+                status=status.HTTP_401_UNAUTHORIZED,
+                message="Unauthorized to import Traffic logs"
+            )
+
+            return JSONResponse(
+                status_code=response.status,
+                content=encode_response(response),
+                media_type="application/json",
+            )
+
+        except ForbiddenException:
+
+            response = ImportResponse(
+                status=status.HTTP_403_FORBIDDEN,
+                message="Resource forbidden, cannot import Traffic logs"
+            )
+
+            return JSONResponse(
+                status_code=response.status,
+                content=encode_response(response),
+                media_type="application/json",
+            )
+
+        except (HarFormatError, UnicodeDecodeError) as error:
+
+            response = ImportResponse(
+                status=status.HTTP_400_BAD_REQUEST,
+                message=f"Invalid HAR file: {error}"
+            )
+
+            return JSONResponse(
+                status_code=response.status,
+                content=encode_response(response),
                 media_type="application/json",
             )
@@ -0,0 +1,67 @@
+import argparse
+import time
+
+import loguru
+
+from database import ReadProfile
+from .repositories import TrafficLogRepository
+from .sharding import default_shard_router
+
+logger = loguru.logger
+
+BATCH_SIZE = 10000
+
+
+def normalize_header_keys(batch_size: int = BATCH_SIZE) -> int:
+    """
+    Backfill: lowercase and trim the header keys of the existing traffic logs,
+    return the number of updated documents. Idempotent, so it can be stopped
+    and run again at any time. Shards are migrated in parallel.
+    """
+
+    # Keys which are not normalized yet: uppercase letters or surrounding whitespace
+    query = {"headers.key": {"$regex": r"[A-Z]|^\s|\s$"}}
+    normalized_headers = {
+        "$map": {
+            "input": "$headers",
+            "in": {"key": {"$toLower": {"$trim": {"input": "$$this.key"}}}, "value": "$$this.value"}
+        }
+    }
+
+    def normalize(shard, collection) -> int:
+        updated = 0
+
+        while True:
+            ids = [document["_id"] for document in collection.find(query, {"_id": 1}).limit(batch_size)]
+            if not ids:
+                return updated
+
+            result = collection.update_many({"_id": {"$in": ids}}, [{"$set": {"headers": normalized_headers}}])
+            if not result.modified_count:
+                logger.warning(f"Shard {shard}: {len(ids)} traffic logs still match but cannot be normalized")
+                return updated
+
+            updated += result.modified_count
+            logger.info(f"Shard {shard}: normalized the header keys of {updated} traffic logs")
+
+    return sum(default_shard_router().scatter(normalize, read_profile=ReadProfile.PRIMARY))
+
+
+MIGRATIONS = {
+    "normalize_header_keys": normalize_header_keys,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a traffic logs data migration")
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    TrafficLogRepository.ensure_indexes()
+    updated = MIGRATIONS[args.migration]()
+    print(f"{args.migration}: {updated} traffic logs updated in {time.perf_counter() - started_at:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
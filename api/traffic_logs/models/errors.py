@@ -13,3 +13,8 @@ class BaseIdentifiedError(BaseError):
 
 class NotFoundError(BaseIdentifiedError):
     """The entity does not exist"""
+
+
+class OverloadedError(BaseError):
+    """The request has been shed by admission control"""
+    retry_after: int = Field(..., description="Seconds to wait before retrying the request")
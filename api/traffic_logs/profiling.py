@@ -0,0 +1,225 @@
+import asyncio
+import cProfile
+import functools
+import hmac
+import io
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config.profiling_setting import profiling_settings
+
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+
+
+class RequestProfile:
+    """
+    Profile of a single request: wall time per phase, plus a cProfile of the
+    code run inside the phases. Sync routes run in the threadpool, so there is
+    one profiler per thread, merged when the profile is rendered.
+
+    Phases on the event loop thread are only timed: requests interleave there,
+    and before Python 3.12 enabling a profiler silently replaces the one of
+    another request instead of raising. Async routes run their blocking phases
+    in the threadpool, where they are profiled.
+    """
+
+    def __init__(self):
+        self.id = str(uuid.uuid4())
+        self.started_at = time.perf_counter()
+        self.handler_started_at = None
+        self.phases = defaultdict(float)
+        self._profilers = {}
+        self._enabled = set()
+        self._active_phases = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def _enter(self, phase: str) -> bool:
+        """Start `phase` on this thread, return False if it is already running (nested call)"""
+
+        thread_id = threading.get_ident()
+
+        with self._lock:
+            if self.handler_started_at is None:
+                self.handler_started_at = time.perf_counter()
+            if phase in self._active_phases[thread_id]:
+                return False
+            self._active_phases[thread_id].append(phase)
+            outermost = len(self._active_phases[thread_id]) == 1
+
+        if outermost and not _on_event_loop():
+            profiler = self._profilers.setdefault(thread_id, cProfile.Profile())
+            try:
+                profiler.enable()
+                self._enabled.add(thread_id)
+            except ValueError:
+                # Another profiler is active on this thread (Python 3.12+), only phase timings are kept
+                pass
+        return True
+
+    def _exit(self, phase: str):
+        thread_id = threading.get_ident()
+
+        with self._lock:
+            self._active_phases[thread_id].remove(phase)
+            outermost = not self._active_phases[thread_id]
+
+        if outermost and thread_id in self._enabled:
+            self._enabled.discard(thread_id)
+            self._profilers[thread_id].disable()
+
+    def timings(self) -> dict:
+        """Milliseconds per phase, routing and validation being everything before the first phase"""
+
+        timings = {"total": (time.perf_counter() - self.started_at) * 1000}
+        if self.handler_started_at is not None:
+            timings["validation"] = (self.handler_started_at - self.started_at) * 1000
+        timings.update({phase: seconds * 1000 for phase, seconds in self.phases.items()})
+
+        return timings
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats()
+        for profiler in self._profilers.values():
+            stats.add(profiler)
+        return stats
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{phase};dur={duration:.2f}" for phase, duration in self.timings().items())
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+@contextmanager
+def profile_phase(name: str):
+    """Account the enclosed block to phase `name` of the profiled request, if any"""
+
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    if not profile._enter(name):
+        yield
+        return
+
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.phases[name] += time.perf_counter() - started_at
+        profile._exit(name)
+
+
+def profiled(name: str):
+    """Decorator version of `profile_phase`"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with profile_phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in per-request profiling, as a plain ASGI middleware: requests which
+    are not selected are passed through untouched, their only cost is one
+    header lookup and one random draw. A request is selected when it carries
+    the profiling header with the configured token, or when it is sampled.
+    """
+
+    def __init__(self, app: ASGIApp, settings=profiling_settings):
+        self.app = app
+        self.settings = settings
+
+    def _requested(self, headers: Headers) -> bool:
+        token = headers.get(self.settings.PROFILING_HEADER)
+        return bool(token and self.settings.PROFILING_TOKEN
+                    and hmac.compare_digest(token, self.settings.PROFILING_TOKEN))
+
+    def _save(self, profile: RequestProfile, method: str) -> str:
+        os.makedirs(self.settings.PROFILING_DIRECTORY, exist_ok=True)
+
+        path = os.path.join(
+            self.settings.PROFILING_DIRECTORY,
+            f"{time.strftime('%Y%m%dT%H%M%S')}-{method}-{profile.id}.prof"
+        )
+        # Loadable with pstats, snakeviz, etc.
+        profile.stats().dump_stats(path)
+
+        return path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = Headers(scope=scope)
+        requested = self._requested(headers)
+        sampled = not requested and random.random() < self.settings.PROFILING_SAMPLE_RATE
+
+        if not requested and not sampled:
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile()
+        inline = requested and headers.get(self.settings.PROFILING_OUTPUT_HEADER) == "inline"
+        status_code = None
+
+        async def send_profiled(message: Message):
+            nonlocal status_code
+
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if inline:
+                    return
+                response_headers = MutableHeaders(scope=message)
+                response_headers["Server-Timing"] = profile.server_timing()
+                response_headers["X-Profile-Id"] = profile.id
+            elif inline:
+                # The response is replaced by the profile
+                return
+
+            await send(message)
+
+        token = _current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_profiled)
+        finally:
+            _current_profile.reset(token)
+
+        if inline:
+            output = io.StringIO()
+            stats = profile.stats()
+            stats.stream = output
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(50)
+
+            response = JSONResponse(
+                status_code=status_code,
+                content={"profile_id": profile.id, "timings": profile.timings(), "stats": output.getvalue()},
+                headers={"Server-Timing": profile.server_timing()}
+            )
+            return await response(scope, receive, send)
+
+        # Writing the dump is blocking file I/O, kept off the event loop
+        await run_in_threadpool(self._save, profile, scope["method"])
@@ -1,62 +1,227 @@
+from typing import List, Optional, Tuple
+
 from bson import ObjectId
 from fastapi.encoders import jsonable_encoder
-from pymongo import ReturnDocument
 
-from database import traffic_log_collection
+from config.database_setting import database_settings, ReadProfile, WriteProfile
+from config.resilience_setting import resilience_settings
+from resilience import hedged
+from .backends import storage_backend
+from .dedup import content_hash, recent_hashes
 from .exceptions import TrafficLogNotFoundException
 from .models.traffic_log_create import TrafficLogCreate
 from .models.traffic_log_read import TrafficLogRead
 from .models.traffic_log_update import TrafficLogUpdate
+from .profiling import profiled
+from .rollups import rollup_buffer
+
+
+def normalize_header_key(key: str) -> str:
+    """Header names are case-insensitive (RFC 9110), they are stored lowercase"""
+
+    return key.strip().lower()
+
+
+def normalize_headers(traffic_log: dict) -> dict:
+    """Normalize in place the header keys of an encoded traffic log"""
+
+    for header in traffic_log.get("headers") or []:
+        header["key"] = normalize_header_key(header["key"])
+
+    return traffic_log
+
+
+def _upsert_many(creates: List[dict], write_profile: WriteProfile) -> List[Tuple[ObjectId, bool]]:
+    """
+    Deduplicated insert of encoded traffic logs, see TrafficLogBackend.upsert_many.
+    Hashes inserted or seen recently resolve in memory, once their cached ids are
+    checked to be still stored (another process may have deleted them), the
+    others hit the backend.
+    """
+
+    results = [None] * len(creates)
+    pending = []
+
+    for index, create in enumerate(creates):
+        create["content_hash"] = content_hash(create)
+        cached_id = recent_hashes.get(create["content_hash"])
+        if cached_id is not None:
+            results[index] = (cached_id, False)
+        else:
+            pending.append(index)
+
+    cached = [index for index, result in enumerate(results) if result is not None]
+    if cached:
+        # Primary, a secondary may not have the documents inserted a moment ago
+        stored = storage_backend.existing([results[index][0] for index in cached], read_profile=ReadProfile.PRIMARY)
+        for index in cached:
+            if results[index][0] not in stored:
+                recent_hashes.discard(creates[index]["content_hash"])
+                results[index] = None
+                pending.append(index)
+        pending.sort()
+
+    if pending:
+        upserted = storage_backend.upsert_many([creates[index] for index in pending], write_profile=write_profile)
+        for index, (traffic_log_id, inserted) in zip(pending, upserted):
+            results[index] = (traffic_log_id, inserted)
+            recent_hashes.put(creates[index]["content_hash"], traffic_log_id)
+
+    return results
 
 
 class TrafficLogRepository:
 
     @staticmethod
-    def get(traffic_log_id: str) -> TrafficLogRead:
-        """Retrieve a single TrafficLog by its unique id"""
+    def ensure_indexes():
+        storage_backend.ensure_indexes()
 
-        document = traffic_log_collection.find_one(
-            {"_id": ObjectId(traffic_log_id)}
-        )
+    @staticmethod
+    @profiled("repository")
+    def get(traffic_log_id: str, read_profile: Optional[ReadProfile] = None) -> TrafficLogRead:
+        """
+        Retrieve a single TrafficLog by its unique id. Without an explicit read
+        profile the read may be hedged, see ResilienceSettings.
+        """
+
+        traffic_log_id = ObjectId(traffic_log_id)
+
+        if read_profile is None and resilience_settings.HEDGE_ENABLED:
+            document = hedged(
+                lambda: storage_backend.get(traffic_log_id, read_profile=database_settings.GET_READ_PROFILE),
+                lambda: storage_backend.get(traffic_log_id, read_profile=resilience_settings.HEDGE_READ_PROFILE),
+                delay=resilience_settings.HEDGE_DELAY
+            )
+        else:
+            document = storage_backend.get(
+                traffic_log_id,
+                read_profile=read_profile or database_settings.GET_READ_PROFILE
+            )
         if not document:
-            raise TrafficLogNotFoundException(traffic_log_id)
+            raise TrafficLogNotFoundException(str(traffic_log_id))
 
         return TrafficLogRead(**document)
 
     @staticmethod
-    def create(create: TrafficLogCreate) -> (ObjectId, TrafficLogRead):
-        """Create a TrafficLog and return its Read object"""
+    @profiled("repository")
+    def create(
+            create: TrafficLogCreate,
+            write_profile: Optional[WriteProfile] = None
+    ) -> (ObjectId, TrafficLogRead, bool):
+        """
+        Create a TrafficLog and return its Read object, or the existing one for
+        a duplicate, and whether it was created
+        """
+
+        write_profile = write_profile or database_settings.CREATE_WRITE_PROFILE
+        normalize_headers(create)
+
+        if not database_settings.DEDUP_ENABLED:
+            inserted_id, inserted = storage_backend.insert(create, write_profile=write_profile), True
+        else:
+            inserted_id, inserted = _upsert_many([create], write_profile)[0]
+
+        if inserted:
+            rollup_buffer.add(inserted_id, create)
+
+        # Fetch-after-write must hit the primary, a secondary may not have the document yet
+        try:
+            return inserted_id, TrafficLogRepository.get(inserted_id, read_profile=ReadProfile.PRIMARY), inserted
+        except TrafficLogNotFoundException:
+            if inserted:
+                raise
+            # Duplicate deleted by another process in the meantime
+            recent_hashes.discard(create["content_hash"])
+            return TrafficLogRepository.create(create, write_profile=write_profile)
+
+    @staticmethod
+    @profiled("repository")
+    def create_many(creates: List[dict], write_profile: Optional[WriteProfile] = None) -> List[ObjectId]:
+        """Create a batch of TrafficLogs, return their ids (existing ones for duplicates) in the order of `creates`"""
 
-        result = traffic_log_collection.insert_one(create)
-        assert result.acknowledged
+        write_profile = write_profile or database_settings.BULK_WRITE_PROFILE
+        creates = [normalize_headers(create) for create in creates]
 
-        return result.inserted_id, TrafficLogRepository.get(result.inserted_id)
+        if not database_settings.DEDUP_ENABLED:
+            results = [(inserted_id, True) for inserted_id in storage_backend.insert_many(creates, write_profile)]
+        else:
+            results = _upsert_many(creates, write_profile)
+
+        for (inserted_id, inserted), create in zip(results, creates):
+            if inserted:
+                rollup_buffer.add(inserted_id, create)
+
+        return [inserted_id for inserted_id, _ in results]
 
     @staticmethod
-    def update(traffic_log_id: str, update: TrafficLogUpdate) -> TrafficLogRead:
+    @profiled("repository")
+    def search_by_header(
+            key: str,
+            value: Optional[str] = None,
+            after: Optional[str] = None,
+            limit: int = 100,
+            read_profile: Optional[ReadProfile] = None
+    ) -> List[Tuple[ObjectId, TrafficLogRead]]:
+        """Retrieve the TrafficLogs carrying a header, optionally with a given value, ordered by id"""
+
+        header = {"key": normalize_header_key(key)}
+        if value is not None:
+            header["value"] = value
+
+        documents = storage_backend.find_by_header(
+            header,
+            after=ObjectId(after) if after else None,
+            limit=limit,
+            read_profile=read_profile or database_settings.LIST_READ_PROFILE
+        )
+
+        return [(document["_id"], TrafficLogRead(**document)) for document in documents]
+
+    @staticmethod
+    @profiled("repository")
+    def update(
+            traffic_log_id: str,
+            update: TrafficLogUpdate,
+            write_profile: Optional[WriteProfile] = None
+    ) -> TrafficLogRead:
         """Update a TrafficLog by giving only the fields to update"""
 
         new_traffic_log = {k: v for k, v in update.dict().items() if v is not None}
-        new_traffic_log = jsonable_encoder(new_traffic_log, exclude_unset=True)
+        new_traffic_log = normalize_headers(jsonable_encoder(new_traffic_log, exclude_unset=True))
 
-        result = traffic_log_collection.find_one_and_update(
-            {"_id": ObjectId(traffic_log_id)},
-            {"$set": new_traffic_log},
-            return_document=ReturnDocument.AFTER
+        # The previous version is needed to move the document between rollup buckets
+        before = storage_backend.update(
+            ObjectId(traffic_log_id),
+            new_traffic_log,
+            write_profile=write_profile or database_settings.UPDATE_WRITE_PROFILE
         )
 
-        if not result:
+        if not before:
             raise TrafficLogNotFoundException(identifier=traffic_log_id)
 
+        # The backend dropped the content hash, identical logs are no longer duplicates of this one
+        recent_hashes.discard(before.get("content_hash"))
+
+        result = {**before, **new_traffic_log}
+
+        if "server" in new_traffic_log or "method" in new_traffic_log:
+            rollup_buffer.add(before["_id"], before, delta=-1)
+            rollup_buffer.add(result["_id"], result)
+
         return TrafficLogRead(**result)
 
     @staticmethod
-    def delete(traffic_log_id: str):
+    @profiled("repository")
+    def delete(traffic_log_id: str, write_profile: Optional[WriteProfile] = None):
         """Delete a TrafficLog given its unique id"""
 
-        result = traffic_log_collection.find_one_and_delete(
-            {"_id": ObjectId(traffic_log_id)}
+        result = storage_backend.delete(
+            ObjectId(traffic_log_id),
+            write_profile=write_profile or database_settings.DELETE_WRITE_PROFILE
         )
 
         if not result:
             raise TrafficLogNotFoundException(identifier=traffic_log_id)
+
+        recent_hashes.discard(result.get("content_hash"))
+        rollup_buffer.add(result["_id"], result, delta=-1)
@@ -0,0 +1,142 @@
+import argparse
+import atexit
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import loguru
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+from config.database_setting import database_settings, ReadProfile
+from resilience import DependencyError
+from .backends import storage_backend
+from .profiling import profiled
+from .schemas import RollupBucket
+
+logger = loguru.logger
+
+
+def _minute(traffic_log_id: ObjectId) -> datetime:
+    """Traffic logs carry no timestamp, their ObjectId creation time is used instead"""
+
+    return traffic_log_id.generation_time.replace(second=0, microsecond=0, tzinfo=None)
+
+
+class RollupBuffer:
+    """
+    Request counters per (host, method, minute), coalesced in memory and
+    flushed as increments to the storage backend every `flush_interval`
+    seconds by a daemon thread.
+
+    A flush which may have been partially applied (timeout, write concern
+    error) is retried as is with its flush id, for the backend to skip the
+    buckets it already reached. Counts certainly not applied go back to the
+    counters, for the next flush.
+    """
+
+    def __init__(self, flush_interval: float = database_settings.ROLLUP_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._counts = Counter()
+        self._retries: List[Tuple[str, Dict]] = []
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def add(self, traffic_log_id: ObjectId, traffic_log: dict, delta: int = 1):
+        """Count `traffic_log` (an encoded TrafficLogCreate or a stored document)"""
+
+        key = (traffic_log["server"]["host"], traffic_log["method"], _minute(traffic_log_id))
+
+        with self._lock:
+            self._counts[key] += delta
+
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name="rollup-flusher", daemon=True)
+                self._flusher.start()
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            retries, self._retries = self._retries, []
+
+        counts = {key: count for key, count in counts.items() if count}
+        if counts:
+            retries.append((uuid.uuid4().hex, counts))
+
+        for flush_id, flush_counts in retries:
+            self._write(flush_id, flush_counts)
+
+    def _write(self, flush_id: str, counts: Dict):
+        try:
+            failed = storage_backend.increment_rollups(
+                counts, flush_id, write_profile=database_settings.BULK_WRITE_PROFILE
+            )
+        except (PyMongoError, sqlite3.Error, DependencyError):
+            logger.exception(f"Error while flushing {len(counts)} rollup buckets, retrying at next flush")
+            with self._lock:
+                self._retries.append((flush_id, counts))
+            return
+
+        if failed:
+            logger.error(f"{len(failed)} of {len(counts)} rollup buckets not flushed, retrying at next flush")
+            with self._lock:
+                self._counts.update(failed)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+rollup_buffer = RollupBuffer()
+atexit.register(rollup_buffer.flush)
+
+
+class RollupRepository:
+
+    @staticmethod
+    @profiled("repository")
+    def list(
+            host: Optional[str] = None,
+            method: Optional[str] = None,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            limit: int = 0,
+            read_profile: Optional[ReadProfile] = None
+    ) -> List[RollupBucket]:
+        """Return the rollup buckets matching the filters, ordered by minute"""
+
+        buckets = storage_backend.find_rollups(
+            host, method, start, end, limit,
+            read_profile=read_profile or database_settings.LIST_READ_PROFILE
+        )
+
+        return [RollupBucket(**bucket) for bucket in buckets]
+
+    @staticmethod
+    def rebuild():
+        """
+        Recompute every rollup bucket from the raw traffic logs. Counters flushed
+        while the rebuild runs are overwritten, so it is best run while
+        ingestion is paused.
+        """
+
+        storage_backend.rebuild_rollups()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the traffic log rollup counters")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    started_at = time.perf_counter()
+    RollupRepository.rebuild()
+    print(f"Rollups rebuilt in {time.perf_counter() - started_at:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
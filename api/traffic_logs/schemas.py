@@ -1,4 +1,5 @@
-from typing import List, Optional
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, Field, AnyHttpUrl
 
@@ -64,4 +65,48 @@ class TrafficLogResponse(BaseModel):
     traffic_log: Optional[TrafficLogOptional] = Field(None)
 
 
+class ImportSummary(BaseModel):
+    entries: int = 0
+    imported: int = 0
+    rejected: int = 0
+    resumed_from: int = 0
+    parse_seconds: float = 0.0
+    map_seconds: float = 0.0
+    insert_seconds: float = 0.0
+    elapsed_seconds: float = 0.0
 
+
+class ImportResponse(BaseModel):
+    status: int
+    message: str
+    summary: Optional[ImportSummary] = Field(None)
+
+
+class RollupBucket(BaseModel):
+    host: str
+    method: str
+    minute: datetime
+    count: int
+
+
+class RollupResponse(BaseModel):
+    status: int
+    message: str
+    buckets: List[RollupBucket] = Field(default_factory=list)
+
+
+class ArchiveResponse(BaseModel):
+    status: int
+    message: str
+    traffic_logs: List[Dict[str, Any]] = Field(default_factory=list)
+
+
+class TrafficLogSearchResult(BaseModel):
+    id: str
+    traffic_log: TrafficLogOptional
+
+
+class TrafficLogSearchResponse(BaseModel):
+    status: int
+    message: str
+    results: List[TrafficLogSearchResult] = Field(default_factory=list)
@@ -0,0 +1,122 @@
+import hashlib
+import time
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Callable, Iterator, List, Optional, TypeVar
+
+from bson import ObjectId
+from pymongo.collection import Collection
+
+from config.admission_setting import admission_settings
+from config.database_setting import database_settings
+from database import collection_for, traffic_log_shards
+
+T = TypeVar("T")
+
+# Byte of the ObjectId (first byte of its per-process random part) holding the shard index
+SHARD_BYTE = 4
+MAX_SHARDS = 256
+
+
+class ShardRouter:
+    """
+    Routes traffic logs over N collections, possibly on different clusters.
+
+    Writes go to the shard picked by hashing the server host and the current
+    time bucket, so a busy host is spread over all shards across time.
+    Deduplicated writes go to the shard picked by their content hash instead,
+    so identical logs always meet the same per-shard unique index. The
+    shard index is written into the ObjectId generated for the document, so
+    reads, updates and deletes by id go straight to the right shard, and ids
+    stay valid ObjectIds (creation time included) for everything else.
+    """
+
+    def __init__(
+            self,
+            shards: List[Collection],
+            time_bucket: int = database_settings.SHARD_TIME_BUCKET,
+            legacy_fallback: bool = database_settings.SHARD_LEGACY_FALLBACK
+    ):
+        if not 0 < len(shards) <= MAX_SHARDS:
+            raise ValueError(f"Between 1 and {MAX_SHARDS} shards are supported, got {len(shards)}")
+
+        self.shards = shards
+        self.time_bucket = time_bucket
+        self.legacy_fallback = legacy_fallback
+        # Shared by all requests: every request admitted at once may scatter over all the shards
+        concurrency = (admission_settings.READ_CONCURRENCY + admission_settings.WRITE_CONCURRENCY
+                       + admission_settings.BULK_CONCURRENCY)
+        self._executor = ThreadPoolExecutor(max_workers=len(shards) * concurrency, thread_name_prefix="shard")
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def shard_for(self, traffic_log: dict) -> int:
+        """Hash the shard key (server host, time bucket) of an encoded traffic log"""
+
+        host = (traffic_log.get("server") or {}).get("host", "")
+        shard_key = f"{host}|{int(time.time()) // self.time_bucket}".encode()
+
+        return int.from_bytes(hashlib.blake2b(shard_key, digest_size=8).digest(), "big") % len(self.shards)
+
+    def shard_for_hash(self, content_hash: str) -> int:
+        """Shard of a deduplicated traffic log, from its (hex sha256) content hash"""
+
+        return int(content_hash[:16], 16) % len(self.shards)
+
+    @staticmethod
+    def new_id(shard: int) -> ObjectId:
+        binary = bytearray(ObjectId().binary)
+        binary[SHARD_BYTE] = shard
+        return ObjectId(bytes(binary))
+
+    def shard_of(self, traffic_log_id: ObjectId) -> int:
+        return traffic_log_id.binary[SHARD_BYTE] % len(self.shards)
+
+    def collection(
+            self,
+            shard: int,
+            read_profile: Optional[str] = None,
+            write_profile: Optional[str] = None
+    ) -> Collection:
+        return collection_for(read_profile, write_profile, collection=self.shards[shard])
+
+    def route(self, traffic_log_id: ObjectId, operation: Callable[[Collection], Optional[T]], **profiles) -> Optional[T]:
+        """
+        Run `operation` on the shard owning `traffic_log_id`. When it finds
+        nothing and the legacy fallback is enabled, the other shards are tried
+        in parallel, for ids issued before the collection was sharded.
+        """
+
+        shard = self.shard_of(traffic_log_id)
+        result = operation(self.collection(shard, **profiles))
+
+        if result is not None or not self.legacy_fallback or len(self.shards) == 1:
+            return result
+
+        others = [index for index in range(len(self.shards)) if index != shard]
+        results = self._map(lambda index: operation(self.collection(index, **profiles)), others)
+
+        return next((result for result in results if result is not None), None)
+
+    def scatter(self, operation: Callable[[int, Collection], T], **profiles) -> List[T]:
+        """Run `operation(shard, collection)` on every shard in parallel, return the results in shard order"""
+
+        if len(self.shards) == 1:
+            return [operation(0, self.collection(0, **profiles))]
+
+        return list(self._map(lambda index: operation(index, self.collection(index, **profiles)),
+                              range(len(self.shards))))
+
+    def _map(self, function: Callable[[int], T], indexes) -> Iterator[T]:
+        # Like Executor.map, but each call runs in a copy of the caller's context (request deadline)
+        futures = [self._executor.submit(copy_context().run, function, index) for index in indexes]
+        return (future.result() for future in futures)
+
+
+@lru_cache(maxsize=None)
+def default_shard_router() -> ShardRouter:
+    """Router over the configured shards, created on first use"""
+
+    return ShardRouter(traffic_log_shards())
@@ -0,0 +1,32 @@
+from pydantic import BaseSettings
+
+
+class AdmissionSettings(BaseSettings):
+    # Per-client token bucket, keyed on the remote address and the (unverified) JWT subject
+    RATE_LIMIT_PER_SECOND: float = 50.0
+    RATE_LIMIT_BURST: int = 100
+    RATE_LIMIT_MAX_CLIENTS: int = 10000
+    # Per remote address token bucket, shared by all the clients behind the address
+    ADDRESS_RATE_LIMIT_PER_SECOND: float = 200.0
+    ADDRESS_RATE_LIMIT_BURST: int = 400
+
+    # Global concurrency limits per route class
+    READ_CONCURRENCY: int = 32
+    WRITE_CONCURRENCY: int = 16
+    BULK_CONCURRENCY: int = 2
+
+    # Maximum number of requests allowed to wait for a slot
+    READ_MAX_QUEUE: int = 64
+    WRITE_MAX_QUEUE: int = 32
+    BULK_MAX_QUEUE: int = 4
+
+    # Maximum time (seconds) a request may wait in queue before being shed
+    READ_LATENCY_TARGET: float = 0.5
+    WRITE_LATENCY_TARGET: float = 1.0
+    BULK_LATENCY_TARGET: float = 2.0
+
+    class Config:
+        env_file = ".env"
+
+
+admission_settings = AdmissionSettings()
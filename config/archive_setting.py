@@ -0,0 +1,15 @@
+from pydantic import BaseSettings
+
+
+class ArchiveSettings(BaseSettings):
+    ARCHIVE_DIRECTORY: str = "./archive"
+    # Traffic logs older than this are moved out of the hot collection
+    ARCHIVE_AFTER_DAYS: int = 30
+    ARCHIVE_BATCH_SIZE: int = 50000
+    ARCHIVE_COMPRESSION: str = "zstd"
+
+    class Config:
+        env_file = ".env"
+
+
+archive_settings = ArchiveSettings()
@@ -1,10 +1,70 @@
+from enum import Enum
+from typing import Dict, List, Optional
+
 from pydantic import BaseSettings
 
 
+class ReadProfile(str, Enum):
+    """Where reads are routed, from strongest to weakest consistency"""
+    PRIMARY = "primary"
+    PRIMARY_PREFERRED = "primary_preferred"
+    SECONDARY_PREFERRED = "secondary_preferred"
+    NEAREST = "nearest"
+
+
+class WriteProfile(str, Enum):
+    """How durable a write must be before it is acknowledged"""
+    MAJORITY = "majority"
+    ACKNOWLEDGED = "acknowledged"
+    UNJOURNALED = "unjournaled"
+
+
 class DatabaseSettings(BaseSettings):
-    URI: str
-    MONGO_DATABASE: str
-    LOGS_COLLECTION: str
+    # Storage backend of the traffic logs: "mongo" or "sqlite" (embedded, for edge deployments)
+    STORAGE_BACKEND: str = "mongo"
+
+    # MongoDB backend, required unless STORAGE_BACKEND is "sqlite"
+    URI: Optional[str] = None
+    MONGO_DATABASE: Optional[str] = None
+    LOGS_COLLECTION: Optional[str] = None
+    ROLLUPS_COLLECTION: str = "traffic_log_rollups"
+
+    # Traffic log shards, as a JSON list of {"uri", "database", "collection"},
+    # missing keys default to URI, MONGO_DATABASE and LOGS_COLLECTION.
+    # Empty means a single shard: LOGS_COLLECTION on URI.
+    SHARDS: List[Dict[str, str]] = []
+    # Seconds of the time component of the shard key
+    SHARD_TIME_BUCKET: int = 3600
+    # Look for ids not found on their shard on all the others (ids issued before sharding)
+    SHARD_LEGACY_FALLBACK: bool = True
+
+    # Content-hash deduplication of identical traffic logs on ingest
+    DEDUP_ENABLED: bool = False
+    # Recent content hashes kept in memory, to skip the database for most duplicates
+    DEDUP_CACHE_SIZE: int = 100000
+
+    # Seconds between two flushes of the in-memory rollup counters
+    ROLLUP_FLUSH_INTERVAL: float = 1.0
+    # Ids of the last flushes kept on each Mongo rollup bucket, so that a retried flush is applied once
+    ROLLUP_FLUSH_MARKERS: int = 100
+
+    # Read routing profiles, overridable per request with the `read_profile` query parameter
+    GET_READ_PROFILE: ReadProfile = ReadProfile.PRIMARY
+    LIST_READ_PROFILE: ReadProfile = ReadProfile.SECONDARY_PREFERRED
+    MAX_STALENESS_SECONDS: int = 90
+
+    # Durability profiles, overridable per request with the `write_profile` query parameter
+    CREATE_WRITE_PROFILE: WriteProfile = WriteProfile.ACKNOWLEDGED
+    UPDATE_WRITE_PROFILE: WriteProfile = WriteProfile.ACKNOWLEDGED
+    DELETE_WRITE_PROFILE: WriteProfile = WriteProfile.ACKNOWLEDGED
+    BULK_WRITE_PROFILE: WriteProfile = WriteProfile.UNJOURNALED
+
+    # Embedded SQLite backend. Every thread has its own connection and page
+    # cache, so heap usage is bounded by threads * SQLITE_CACHE_SIZE_KB
+    SQLITE_PATH: str = "./traffic_logs.sqlite3"
+    SQLITE_CACHE_SIZE_KB: int = 8192
+    SQLITE_MMAP_SIZE_MB: int = 64
+    SQLITE_BUSY_TIMEOUT: float = 5.0
 
     class Config:
         env_file = "./.env"
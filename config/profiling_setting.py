@@ -0,0 +1,21 @@
+from typing import Optional
+
+from pydantic import BaseSettings
+
+
+class ProfilingSettings(BaseSettings):
+    # Requests carrying PROFILING_HEADER set to PROFILING_TOKEN are profiled,
+    # header-triggered profiling is disabled while no token is configured
+    PROFILING_HEADER: str = "X-Profile"
+    PROFILING_TOKEN: Optional[str] = None
+    # "inline" returns the profile instead of the response, anything else saves it
+    PROFILING_OUTPUT_HEADER: str = "X-Profile-Output"
+    # Fraction of all requests profiled and saved, 0 disables sampling
+    PROFILING_SAMPLE_RATE: float = 0.0
+    PROFILING_DIRECTORY: str = "./profiles"
+
+    class Config:
+        env_file = ".env"
+
+
+profiling_settings = ProfilingSettings()
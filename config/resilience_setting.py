@@ -0,0 +1,34 @@
+from pydantic import BaseSettings
+
+from config.database_setting import ReadProfile
+
+
+class ResilienceSettings(BaseSettings):
+    # Header carrying the caller's time budget (seconds), capped to REQUEST_TIMEOUT
+    DEADLINE_HEADER: str = "X-Request-Timeout"
+    # Time budget (seconds) of a request, bulk requests have none
+    REQUEST_TIMEOUT: float = 10.0
+
+    # Time budget (seconds) of a single call to each dependency, within the request one
+    MONGO_TIMEOUT: float = 5.0
+    JWKS_TIMEOUT: float = 2.0
+    # A Mongo timeout counts as a breaker failure when its budget was at least this long (or MONGO_TIMEOUT)
+    MONGO_BREAKER_TIMEOUT_FLOOR: float = 1.0
+
+    # Consecutive failures opening a circuit, seconds before a trial call is let through
+    BREAKER_FAILURE_THRESHOLD: int = 5
+    BREAKER_RESET_TIMEOUT: float = 30.0
+
+    # How long (seconds) the last JWK set may be served while the JWKS endpoint is down
+    JWKS_STALE_TTL: float = 86400
+
+    # Hedged gets: a second read is sent to HEDGE_READ_PROFILE when the first is slower than HEDGE_DELAY
+    HEDGE_ENABLED: bool = False
+    HEDGE_DELAY: float = 0.05
+    HEDGE_READ_PROFILE: ReadProfile = ReadProfile.SECONDARY_PREFERRED
+
+    class Config:
+        env_file = ".env"
+
+
+resilience_settings = ResilienceSettings()
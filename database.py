@@ -1,6 +1,124 @@
+import functools
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import pymongo
 from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.errors import ConnectionFailure, PyMongoError
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, SecondaryPreferred
+from pymongo.write_concern import WriteConcern
+
+from config.database_setting import database_settings, ReadProfile, WriteProfile
+from config.resilience_setting import resilience_settings
+from resilience import budget, CircuitBreaker, DeadlineExceeded, DependencyUnavailable
+
+# Clients and collections are created on first use: deployments on the sqlite
+# backend have neither a MongoDB nor its settings.
+
+
+@lru_cache(maxsize=None)
+def _client(uri: str) -> MongoClient:
+    return MongoClient(uri)
+
+
+def _setting(name: str, value: Optional[str]) -> str:
+    if not value:
+        raise ValueError(f"{name} must be set to use MongoDB")
+    return value
+
+
+def _shard_collection(shard: Dict[str, str]) -> Collection:
+    shard_client = _client(shard.get("uri") or _setting("URI", database_settings.URI))
+    return shard_client[shard.get("database") or _setting("MONGO_DATABASE", database_settings.MONGO_DATABASE)][
+        shard.get("collection") or _setting("LOGS_COLLECTION", database_settings.LOGS_COLLECTION)
+    ]
+
+
+@lru_cache(maxsize=None)
+def traffic_log_collection() -> Collection:
+    return _shard_collection({})
+
+
+@lru_cache(maxsize=None)
+def traffic_log_rollup_collection() -> Collection:
+    return _shard_collection({"collection": database_settings.ROLLUPS_COLLECTION})
+
+
+@lru_cache(maxsize=None)
+def traffic_log_shards() -> List[Collection]:
+    return [_shard_collection(shard) for shard in database_settings.SHARDS] or [traffic_log_collection()]
+
+
+def _read_preference(profile: ReadProfile):
+    max_staleness = database_settings.MAX_STALENESS_SECONDS
+
+    if profile == ReadProfile.PRIMARY:
+        return Primary()
+    if profile == ReadProfile.PRIMARY_PREFERRED:
+        return PrimaryPreferred(max_staleness=max_staleness)
+    if profile == ReadProfile.SECONDARY_PREFERRED:
+        return SecondaryPreferred(max_staleness=max_staleness)
+    return Nearest(max_staleness=max_staleness)
+
+
+def _write_concern(profile: WriteProfile) -> WriteConcern:
+    if profile == WriteProfile.MAJORITY:
+        return WriteConcern(w="majority", j=True)
+    if profile == WriteProfile.UNJOURNALED:
+        return WriteConcern(w=1, j=False)
+    return WriteConcern(w=1)
+
+
+@lru_cache(maxsize=None)
+def collection_for(
+        read_profile: Optional[ReadProfile] = None,
+        write_profile: Optional[WriteProfile] = None,
+        collection: Optional[Collection] = None
+) -> Collection:
+    """Return `collection` (default: the traffic logs) configured with the given read routing and durability profiles"""
+
+    return (collection if collection is not None else traffic_log_collection()).with_options(
+        read_preference=_read_preference(ReadProfile(read_profile)) if read_profile else None,
+        write_concern=_write_concern(WriteProfile(write_profile)) if write_profile else None
+    )
+
+
+# One breaker for the whole deployment: shards are expected to fail together (network, DNS, auth)
+mongo_breaker = CircuitBreaker("mongo")
+
+
+def guarded(operation):
+    """
+    Run a Mongo operation under the mongo circuit breaker, with a client-side
+    timeout (pymongo CSOT) set to the remaining time budget. Only connection
+    failures and timeouts of a budget of at least MONGO_BREAKER_TIMEOUT_FLOOR
+    count as failures: a request running out of its last milliseconds says
+    nothing about the database, but requests arriving with less than
+    MONGO_TIMEOUT left must still open the circuit when Mongo stalls.
+    """
+
+    floor = min(resilience_settings.MONGO_BREAKER_TIMEOUT_FLOOR, resilience_settings.MONGO_TIMEOUT)
+
+    @functools.wraps(operation)
+    def wrapper(*args, **kwargs):
+        timeout = budget(resilience_settings.MONGO_TIMEOUT)
+        conclusive = timeout >= floor
+
+        def is_failure(error: BaseException) -> Optional[bool]:
+            if isinstance(error, PyMongoError) and error.timeout:
+                return True if conclusive else None
+            return isinstance(error, ConnectionFailure)
 
-from config.database_setting import database_settings
+        try:
+            with mongo_breaker.guard(is_failure), pymongo.timeout(timeout):
+                return operation(*args, **kwargs)
+        except PyMongoError as error:
+            # Translated outside of the guard, which must see the raw error itself
+            if error.timeout:
+                raise DeadlineExceeded(f"MongoDB did not answer within {timeout:.3f}s") from error
+            if isinstance(error, ConnectionFailure):
+                raise DependencyUnavailable("mongo", retry_after=1) from error
+            raise
 
-client = MongoClient(database_settings.URI)
-traffic_log_collection = client[database_settings.MONGO_DATABASE][database_settings.LOGS_COLLECTION]
+    return wrapper
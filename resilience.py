@@ -0,0 +1,212 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Callable, Optional, TypeVar
+
+from config.admission_setting import admission_settings
+from config.resilience_setting import resilience_settings
+
+T = TypeVar("T")
+
+# Absolute time.monotonic() deadline of the current request
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DependencyError(Exception):
+    """A dependency call did not complete: it timed out, failed to connect or its circuit is open"""
+
+
+class DeadlineExceeded(DependencyError):
+    """The request (or dependency) time budget ran out"""
+
+
+class DependencyUnavailable(DependencyError):
+    """A dependency could not be reached, callers should retry after retry_after seconds"""
+
+    def __init__(self, name: str, retry_after: float, message: Optional[str] = None):
+        super().__init__(message or f"Dependency '{name}' is unavailable, retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(DependencyUnavailable):
+    """A dependency is failing, calls are refused until its circuit closes"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(name, retry_after, f"Circuit '{name}' is open, retry in {retry_after:.1f}s")
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    """Bound the enclosed block (and what it calls) to `seconds`, never extending an outer deadline"""
+
+    if seconds is None:
+        yield
+        return
+
+    current = _deadline.get()
+    expires_at = time.monotonic() + seconds
+    token = _deadline.set(expires_at if current is None else min(current, expires_at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, None without a deadline"""
+
+    expires_at = _deadline.get()
+    return None if expires_at is None else expires_at - time.monotonic()
+
+
+def budget(timeout: float) -> float:
+    """Time budget of a dependency call: its own timeout, cut to what is left of the request"""
+
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+    return timeout if left is None else min(timeout, left)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker. Once open, calls fail immediately
+    until `reset_timeout` has elapsed; a single trial call is then let
+    through (half-open), closing the circuit on success, reopening it on
+    failure.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            failure_threshold: int = resilience_settings.BREAKER_FAILURE_THRESHOLD,
+            reset_timeout: float = resilience_settings.BREAKER_RESET_TIMEOUT
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may go through"""
+
+        with self._lock:
+            if self.opened_at is None:
+                return
+
+            elapsed = time.monotonic() - self.opened_at
+            if elapsed < self.reset_timeout or self._trial:
+                raise CircuitOpenError(self.name, retry_after=max(self.reset_timeout - elapsed, 1))
+
+            self._trial = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    def record_nothing(self):
+        """The call told nothing about the dependency, a trial slot is given back"""
+
+        with self._lock:
+            self._trial = False
+
+    @contextmanager
+    def guard(self, is_failure: Callable[[BaseException], Optional[bool]] = lambda error: True):
+        """
+        Run the enclosed call through the breaker. Errors for which `is_failure`
+        is False (e.g. a duplicate key) prove the dependency is up, None means
+        the error says nothing about it (e.g. the caller ran out of time).
+        """
+
+        self.allow()
+        try:
+            yield
+        except Exception as error:
+            verdict = is_failure(error)
+            if verdict:
+                self.record_failure()
+            elif verdict is None:
+                self.record_nothing()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+
+
+# A hedged get holds up to two hedge threads, and admission control lets at most READ_CONCURRENCY reads in
+_hedge_workers = 2 * admission_settings.READ_CONCURRENCY
+_hedge_executor = ThreadPoolExecutor(max_workers=_hedge_workers, thread_name_prefix="hedge")
+_hedge_slots = threading.BoundedSemaphore(_hedge_workers)
+
+
+def _submit(call: Callable[[], T]) -> Optional[Future]:
+    """Run `call` on a hedge thread, None when they are all busy (never queue behind other reads)"""
+
+    if not _hedge_slots.acquire(blocking=False):
+        return None
+
+    future = _hedge_executor.submit(copy_context().run, call)
+    future.add_done_callback(lambda _: _hedge_slots.release())
+    return future
+
+
+def hedged(
+        call: Callable[[], T],
+        hedge: Callable[[], T],
+        delay: float,
+        accept: Callable[[T], bool] = lambda result: result is not None
+) -> T:
+    """
+    Run `call`; when it has not succeeded after `delay` seconds, run `hedge`
+    as well and return whichever succeeds first. A hedge result is only taken
+    when `accept`ed (a secondary may not have the document yet), otherwise
+    the outcome of `call` is returned. The losing call is not cancelled, it
+    is bounded by the deadline it inherits. When the hedge threads are all
+    busy, `call` runs unhedged on the calling thread.
+    """
+
+    first = _submit(call)
+    if first is None:
+        return call()
+
+    done, _ = wait([first], timeout=delay)
+    if done and not first.exception():
+        return first.result()
+
+    second = _submit(hedge)
+    pending = set() if done else {first}
+    if second is not None:
+        pending.add(second)
+
+    while pending:
+        done, pending = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceeded("Request deadline exceeded")
+
+        for future in done:
+            if future.exception():
+                continue
+            if future is first or accept(future.result()):
+                return future.result()
+
+    return first.result()
@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+
+# Settings are read when the modules are imported: dummy auth settings (tokens are
+# not verified in the tests) and the embedded backend instead of MongoDB
+for name in ("GRANT_TYPE", "CLIENT_ID", "CLIENT_SECRET", "AUDIENCE", "ISSUER"):
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("ALGORITHM", "RS256")
+for name in ("TOKEN_ENDPOINT", "AUTH_ENDPOINT", "JWKS_ENDPOINT"):
+    os.environ.setdefault(name, "http://127.0.0.1:1/")
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "traffic_logs.sqlite3")
+# Short dependency budgets, so that the fault injection tests run fast
+os.environ.setdefault("MONGO_TIMEOUT", "0.5")
+os.environ.setdefault("MONGO_BREAKER_TIMEOUT_FLOOR", "0.2")
+os.environ.setdefault("JWKS_TIMEOUT", "0.3")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
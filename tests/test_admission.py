@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from api.traffic_logs import main
+from api.traffic_logs.admission import AdmissionController
+from api.traffic_logs.models.traffic_log_read import TrafficLogRead
+from api.traffic_logs.schemas import ImportSummary
+from config.admission_setting import AdmissionSettings
+
+TRAFFIC_LOG_ID = "0123456789abcdef01234567"
+AUTHORIZATION = {"Authorization": "Bearer token"}
+
+# Stubbed repository: serves SERVICE_TIME reads, CAPACITY at a time, like a saturated database
+SERVICE_TIME = 0.05
+CAPACITY = 4
+BULK_TIME = 0.5
+
+TRAFFIC_LOG = TrafficLogRead(
+    scheme="https",
+    http_version="HTTP/1.1",
+    method="GET",
+    server={"host": "example.com", "port": 443},
+    client={"host": "10.0.0.1", "port": 50000},
+    url="https://example.com/",
+    headers=[{"key": "accept", "value": "*/*"}],
+)
+
+
+@pytest.fixture(autouse=True)
+def stubbed(monkeypatch):
+    database = threading.Semaphore(CAPACITY)
+
+    def get(traffic_log_id, read_profile=None):
+        with database:
+            time.sleep(SERVICE_TIME)
+        return TRAFFIC_LOG
+
+    def import_har_file(path, write_profile=None):
+        time.sleep(BULK_TIME)
+        return ImportSummary()
+
+    monkeypatch.setattr(main.auth_app.token_verifier, "verify", lambda access_token: None)
+    monkeypatch.setattr(main.TrafficLogRepository, "get", staticmethod(get))
+    monkeypatch.setattr(main, "import_har_file", import_har_file)
+
+
+def admit(monkeypatch, **settings) -> AdmissionController:
+    controller = AdmissionController(AdmissionSettings(**settings))
+    monkeypatch.setattr(main, "admission_controller", controller)
+    return controller
+
+
+def assert_retry_after(response: httpx.Response):
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_rate_limited_client_gets_429(monkeypatch):
+    admit(monkeypatch, RATE_LIMIT_PER_SECOND=0.1, RATE_LIMIT_BURST=2)
+    client = TestClient(main.app)
+
+    responses = [client.get(f"/agent/traffic_logs/{TRAFFIC_LOG_ID}", headers=AUTHORIZATION) for _ in range(3)]
+
+    assert [response.status_code for response in responses] == [200, 200, 429]
+    assert_retry_after(responses[-1])
+
+
+def test_overload_sheds_bulk_and_bounds_read_latency(monkeypatch):
+    latency_target = 0.1
+    admit(
+        monkeypatch,
+        RATE_LIMIT_BURST=10000, ADDRESS_RATE_LIMIT_BURST=10000,
+        READ_CONCURRENCY=CAPACITY, READ_MAX_QUEUE=2 * CAPACITY, READ_LATENCY_TARGET=latency_target,
+        BULK_CONCURRENCY=1, BULK_MAX_QUEUE=1,
+    )
+    reads, bulks = 120, 3
+
+    async def request(client: httpx.AsyncClient, method: str, url: str, **kwargs):
+        started_at = time.perf_counter()
+        response = await client.request(method, url, headers=AUTHORIZATION, **kwargs)
+        return response, time.perf_counter() - started_at
+
+    async def run():
+        async with httpx.AsyncClient(app=main.app, base_url="http://test") as client:
+            tasks = [request(client, "GET", f"/agent/traffic_logs/{TRAFFIC_LOG_ID}") for _ in range(reads)]
+            tasks += [request(client, "POST", "/agent/traffic_logs/import", content=b"{}") for _ in range(bulks)]
+            return await asyncio.gather(*tasks)
+
+    results = asyncio.run(run())
+    read_results, bulk_results = results[:reads], results[reads:]
+
+    # Unbounded, the last reads would wait reads / CAPACITY * SERVICE_TIME = 1.5s
+    latencies = sorted(latency for _, latency in read_results)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    assert p99 < latency_target + 2 * SERVICE_TIME + 0.3
+
+    read_statuses = {response.status_code for response, _ in read_results}
+    assert read_statuses == {200, 503}
+
+    bulk_statuses = [response.status_code for response, _ in bulk_results]
+    assert set(bulk_statuses) <= {201, 503}
+    assert 503 in bulk_statuses
+
+    for response, _ in results:
+        if response.status_code == 503:
+            assert_retry_after(response)
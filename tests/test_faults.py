@@ -0,0 +1,207 @@
+import base64
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+
+from api.auth.utils import ResilientJWKClient
+from api.traffic_logs.backends import MongoBackend
+from api.traffic_logs.sharding import ShardRouter
+from config.resilience_setting import resilience_settings
+from database import mongo_breaker, ReadProfile
+from resilience import CircuitOpenError, DeadlineExceeded, deadline, hedged
+
+# Fault injection against local stand-ins of the service dependencies: tail
+# latency must stay bounded by the dependency budgets while they degrade.
+# The budgets are shortened in conftest.py.
+
+# Scheduling and server selection slack on top of a budget
+SLACK = 0.25
+# A call refused by an open circuit
+FAST = 0.05
+
+
+class Blackhole:
+    """TCP server accepting connections and never answering, like a stalled mongod"""
+
+    def __init__(self):
+        self._socket = socket.socket()
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(128)
+        self._connections = []
+        self.port = self._socket.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            self._connections.append(self._socket.accept())
+
+
+class Jwks:
+    """JWKS endpoint stand-in, healthy or stalling for `stall` seconds"""
+
+    def __init__(self, jwk: dict):
+        self.stall = 0.0
+        jwks = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(jwks.stall)
+                body = json.dumps({"keys": [jwk]}).encode()
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except ConnectionError:
+                    # The client timed out while the endpoint stalled
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/.well-known/jwks.json"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def timed(call):
+    """Run `call`, return the error it raised (None on success) and its latency"""
+
+    started_at = time.perf_counter()
+    try:
+        call()
+        error = None
+    except Exception as raised:
+        error = raised
+    return error, time.perf_counter() - started_at
+
+
+@pytest.fixture
+def breaker():
+    mongo_breaker.record_success()
+    yield mongo_breaker
+    mongo_breaker.record_success()
+
+
+@pytest.fixture
+def stalled_backend():
+    blackhole = Blackhole()
+    client = MongoClient(f"mongodb://127.0.0.1:{blackhole.port}/?directConnection=true")
+    yield MongoBackend(ShardRouter([client["faults"]["traffic_logs"]]), client["faults"]["traffic_log_rollups"])
+    client.close()
+
+
+def get(backend: MongoBackend, request_timeout: float):
+    with deadline(request_timeout):
+        backend.get(ObjectId(), ReadProfile.PRIMARY)
+
+
+@pytest.mark.parametrize("request_timeout", [
+    # The request has more time left than MONGO_TIMEOUT: each get is cut to it
+    pytest.param(resilience_settings.REQUEST_TIMEOUT, id="mongo budget"),
+    # Less, but still above the floor: its timeouts open the circuit all the same
+    pytest.param(resilience_settings.MONGO_TIMEOUT / 2, id="short request budget"),
+])
+def test_stalled_mongo_opens_circuit(breaker, stalled_backend, request_timeout):
+    threshold = resilience_settings.BREAKER_FAILURE_THRESHOLD
+
+    for _ in range(threshold):
+        error, latency = timed(lambda: get(stalled_backend, request_timeout))
+        assert isinstance(error, DeadlineExceeded)
+        # Server selection polls every 500ms, a shorter request budget may be rounded up to it
+        assert latency <= resilience_settings.MONGO_TIMEOUT + SLACK
+
+    assert breaker.is_open
+
+    for _ in range(3):
+        error, latency = timed(lambda: get(stalled_backend, request_timeout))
+        assert isinstance(error, CircuitOpenError)
+        assert latency <= FAST
+
+
+def test_request_out_of_time_does_not_open_circuit(breaker, stalled_backend):
+    # Below MONGO_BREAKER_TIMEOUT_FLOOR, a timeout tells about the request, not about Mongo
+    request_timeout = resilience_settings.MONGO_BREAKER_TIMEOUT_FLOOR / 2
+
+    for _ in range(resilience_settings.BREAKER_FAILURE_THRESHOLD + 1):
+        error, latency = timed(lambda: get(stalled_backend, request_timeout))
+        assert isinstance(error, DeadlineExceeded)
+        assert latency <= resilience_settings.MONGO_TIMEOUT + SLACK
+
+    assert not breaker.is_open
+
+
+def test_stale_keys_verify_while_jwks_stalls():
+    # Symmetric key, the stand-in is about latency, not about the signature scheme
+    secret = b"fault-injection-secret-of-32-bytes"
+    jwk = {"kty": "oct", "kid": "faults", "use": "sig", "alg": "HS256",
+           "k": base64.urlsafe_b64encode(secret).rstrip(b"=").decode()}
+    token = jwt.encode({"sub": "faults"}, secret, algorithm="HS256", headers={"kid": "faults"})
+
+    endpoint = Jwks(jwk)
+    # Short-lived cache, so that every call goes to the endpoint
+    client = ResilientJWKClient(endpoint.url, lifespan=0.001)
+
+    def verify():
+        # Past the cache lifespan
+        time.sleep(0.002)
+        with deadline(resilience_settings.REQUEST_TIMEOUT):
+            key = client.get_signing_key_from_jwt(token).key
+            jwt.decode(token, key, algorithms=["HS256"])
+
+    error, _ = timed(verify)
+    assert error is None
+
+    endpoint.stall = 10 * resilience_settings.JWKS_TIMEOUT
+    threshold = resilience_settings.BREAKER_FAILURE_THRESHOLD
+
+    for _ in range(threshold):
+        error, latency = timed(verify)
+        assert error is None
+        assert latency <= resilience_settings.JWKS_TIMEOUT + SLACK
+
+    assert client.breaker.is_open
+
+    for _ in range(3):
+        error, latency = timed(verify)
+        assert error is None
+        assert latency <= FAST
+
+
+def test_hedge_bounds_latency_spikes():
+    spike = 0.15
+    calls = 20
+    served = []
+
+    def primary():
+        # Every fifth read hits a latency spike
+        served.append("primary")
+        time.sleep(spike if len(served) % 5 == 0 else 0.002)
+        return "primary"
+
+    def secondary():
+        time.sleep(0.002)
+        return "secondary"
+
+    unhedged = [timed(primary)[1] for _ in range(calls)]
+    assert max(unhedged) >= spike
+
+    served.clear()
+    results, latencies = [], []
+    for _ in range(calls):
+        started_at = time.perf_counter()
+        results.append(hedged(primary, secondary, delay=resilience_settings.HEDGE_DELAY))
+        latencies.append(time.perf_counter() - started_at)
+
+    assert "secondary" in results
+    # The secondary answers HEDGE_DELAY after the spiking reads, well before them
+    assert max(latencies) <= resilience_settings.HEDGE_DELAY + 0.05 < spike